@@ -1,6 +1,7 @@
 #!/usr/bin/env python3.12
 
 import os
+import io
 import sys, traceback
 import asyncio
 import re
@@ -9,14 +10,17 @@ import discord
 from discord.ext import commands
 from discord.app_commands import Range as PRange
 
-import bp_to_img, settings, guildconfig
+import settings, guildconfig, render_pool
+from bp_to_img import RenderContext
 from classes import MessageOrInteraction, InteractiveBlueprint, firing_order_options, aspect_ratio_options, PermissionState
 
 
 log = settings.logging.getLogger("bot")
 
-# guild/channel config manager
-GCM = guildconfig.GuildconfigManager()
+# guild/channel config manager and blueprint rendering worker processes, created in the main block,
+# as render worker processes import this module again
+GCM: guildconfig.GuildconfigManager = None
+RENDER_POOL: render_pool.RenderPool = None
 
 # keyword search expression
 keywords_re_dict = {"timing": re.compile(r"(?:^|[_*~`\s])(stats|statistics|timing|time)(?:[_*~`\s]|$)"),
@@ -32,7 +36,8 @@ keywords_re_dict = {"timing": re.compile(r"(?:^|[_*~`\s])(stats|statistics|timin
 lastError = None
 
 
-bot = commands.Bot(command_prefix = "bp!", intents=settings.get_bot_intents())
+# discord client, created in the main block with the events and commands of this module
+bot: commands.Bot = None
 
 
 def print_cmd(ctx: commands.Context):
@@ -100,7 +105,6 @@ class AutoRemoveFile(discord.File):
 #    return (ctx.guild == None) or (ctx.channel.permissions_for(ctx.author) == discord.Permissions.manage_channels)
 
 
-@bot.event
 async def on_ready():
     log.info(f"{bot.user} has connected to Discord!")
     removed = GCM.removeUnused(bot.guilds)
@@ -128,7 +132,6 @@ async def on_ready():
         log.error(str(err))
 
 
-@bot.event
 async def on_guild_remove(guild):
     success = GCM.removeGuild(guild)
     if success:
@@ -137,7 +140,6 @@ async def on_guild_remove(guild):
         log.info(f"Guild removal unsuccessful.")
 
 
-@bot.event
 async def on_message(message: discord.Message):
     """Handle all messages"""
     # skip all bot messages
@@ -158,7 +160,7 @@ async def on_message(message: discord.Message):
 
 
 # TODO
-@bot.command(name="print", help="DEPRECATED (use right click context menu). Print last blueprint uploaded to channel. Only checks last 30 messages.")
+@commands.command(name="print", help="DEPRECATED (use right click context menu). Print last blueprint uploaded to channel. Only checks last 30 messages.")
 async def cmd_print(ctx: commands.Context):
     """Find and print last blueprint in channel"""
     await ctx.send("This command is no longer supported. Use right click context menu instead.")
@@ -170,7 +172,7 @@ async def cmd_print(ctx: commands.Context):
 
 
 
-@bot.hybrid_command(name="mode", help="Set mode for current channel.\nAllowed arguments:\noff \t Turned off.\non \t Turned on.\nprivate \t Interaction only visible to user.",
+@commands.hybrid_command(name="mode", help="Set mode for current channel.\nAllowed arguments:\noff \t Turned off.\non \t Turned on.\nprivate \t Interaction only visible to user.",
             require_var_positional=False, usage="off | on | private")
 @commands.has_permissions(manage_channels=True)
 @discord.app_commands.default_permissions(discord.Permissions(manage_channels=True))
@@ -495,7 +497,7 @@ def PermissionOverwrite_any(self: discord.PermissionOverwrite, other: discord.Pe
 discord.PermissionOverwrite.any = PermissionOverwrite_any
 
 
-@bot.hybrid_command(name="whycant", help="Helps with permissions conflict resolution.",
+@commands.hybrid_command(name="whycant", help="Helps with permissions conflict resolution.",
                     require_var_positional=False)
 @discord.app_commands.describe(
     member="Member ID or i for yourself",
@@ -604,7 +606,7 @@ async def cmd_whycant(ctx: commands.Context, member: str="I", do: str="use_appli
 
 
 
-@bot.command(name="pp&tos", help="Send links to privacy policy and terms of service.")
+@commands.command(name="pp&tos", help="Send links to privacy policy and terms of service.")
 async def cmd_pptos(ctx: commands.Context):
     """Send PP and TOS links to chat"""
     print_cmd(ctx)
@@ -630,7 +632,7 @@ async def send_limited(sender: commands.Context|discord.User, text_list: list[st
 
 
 
-@bot.command(name="test", help="For testing stuff. (Author only)")
+@commands.command(name="test", help="For testing stuff. (Author only)")
 @commands.is_owner()
 async def cmd_test(ctx: commands.Context, args: str = ""):
     """Testing function"""
@@ -675,7 +677,7 @@ async def cmd_test(ctx: commands.Context, args: str = ""):
 
 
 
-@bot.command(name="operms")
+@commands.command(name="operms")
 @commands.is_owner()
 async def cmd_owner_perms(ctx: commands.Context, channel_id: str, member_id: str = "", filter: str = ""):
     """Lists (filtered) permissions for member/role in the channel. Or lists all roles.
@@ -719,7 +721,7 @@ async def cmd_owner_perms(ctx: commands.Context, channel_id: str, member_id: str
 
 
 
-@bot.command(name="omode")
+@commands.command(name="omode")
 @commands.is_owner()
 async def cmd_owner_mode(ctx: commands.Context, *args: str):
     """List or set mode for channels. For debugging and testing.
@@ -780,7 +782,7 @@ async def cmd_owner_mode(ctx: commands.Context, *args: str):
 
 
 
-@bot.command(name="notifydeprecated", help="Sends deprecation notification to channels where bot is in mode 'on'")
+@commands.command(name="notifydeprecated", help="Sends deprecation notification to channels where bot is in mode 'on'")
 @commands.is_owner()
 async def cmd_notify_deprecated(ctx: commands.Context, confirm: str = ""):
     confirm = confirm == "confirm"
@@ -809,7 +811,6 @@ async def cmd_notify_deprecated(ctx: commands.Context, confirm: str = ""):
     await ctx.channel.send(f"{"" if confirm else "(Would have) "}Notified total of {count-failed_count} channels, with {failed_count} failed")
 
 
-@bot.event
 async def on_command_error(ctx: commands.Context, error):
     """Command error exception"""
     log.error("[ERR] <cmd:%s> %s", str(type(error)), str(error))
@@ -824,7 +825,6 @@ async def on_command_error(ctx: commands.Context, error):
         await ctx.message.add_reaction("\u2753")  # :question:
 
 
-@bot.event
 async def on_reaction_add(reaction, user):
     """React to thumbs down reaction on image"""
     #print("Found reaction", reaction, "from user", user)
@@ -972,7 +972,7 @@ class SlashCmdGroup(discord.app_commands.Group):
 
 
 
-@bot.tree.context_menu(name="Simple Blueprint")
+@discord.app_commands.context_menu(name="Simple Blueprint")
 @discord.app_commands.default_permissions(default_perms_app_command)
 async def cm_print(interaction: discord.Interaction, message: discord.Message):
     if (await check_mode(interaction)) is None:
@@ -990,7 +990,7 @@ async def cm_print(interaction: discord.Interaction, message: discord.Message):
 
 
 
-@bot.tree.context_menu(name="Simple Gif")
+@discord.app_commands.context_menu(name="Simple Gif")
 @discord.app_commands.default_permissions(default_perms_app_command)
 async def cm_gif(interaction: discord.Interaction, message: discord.Message):
     if (await check_mode(interaction)) is None:
@@ -1007,7 +1007,7 @@ async def cm_gif(interaction: discord.Interaction, message: discord.Message):
             log.warning("Interaction response failed")
 
 
-@bot.tree.context_menu(name="Interactive Blueprint")
+@discord.app_commands.context_menu(name="Interactive Blueprint")
 @discord.app_commands.default_permissions(default_perms_app_command)
 async def cm_interactive(interaction: discord.Interaction, message: discord.Message):
     if len(message.attachments) == 0:
@@ -1047,24 +1047,48 @@ async def cm_interactive(interaction: discord.Interaction, message: discord.Mess
 async def process_attachment(moi: MessageOrInteraction, attachment: discord.Attachment, do_timing:bool, **kwargs: any
                         #make_gif: bool, firing_order: int|None, cut_stf: tuple[float, float, float]|None,
                         #nocol: bool, timing: bool, aspect_ratio: float|None
-                    ) -> tuple[AutoRemoveFile, str] | tuple[None, None]:
+                    ) -> tuple[discord.File, str] | tuple[None, None]:
     try:
         fname = os.path.join(settings.BP_FOLDER, attachment.filename)
-        img_fname, timing = await bp_to_img.process_blueprint([fname, await attachment.read()], **kwargs)
+        (img_output, timing), context = await RENDER_POOL.render([fname, await attachment.read()],
+                                                                 measure_memory=do_timing, in_memory=True,
+                                                                 png_compression=settings.PNG_COMPRESSION,
+                                                                 png_quantize=settings.PNG_QUANTIZE,
+                                                                 max_image_bytes=settings.IMAGE_MAX_BYTES,
+                                                                 **kwargs)
+    except render_pool.RenderQueueFull:
+        log.warning("Render queue full, rejected %s", attachment.filename)
+        await moi.send("Too many blueprints are being processed right now. Please try again later.")
+        return None, None
+    except render_pool.RenderTimeout:
+        log.warning("Render timed out for %s", attachment.filename)
+        await moi.send("Processing your blueprint took too long and was stopped.")
+        return None, None
+    except render_pool.RenderError as err:
+        lastError = sys.exc_info()
+        await handle_blueprint_error(moi, lastError, attachment.filename, err.context)
+        return None, None
     except:
         # TODO
         lastError = sys.exc_info()
-        await handle_blueprint_error(moi, lastError, attachment.filename, bp_to_img.bp_gameversion)
+        await handle_blueprint_error(moi, lastError, attachment.filename, None)
         # TODO: check if a file was created and delete
         return None, None
-    img_file = AutoRemoveFile(img_fname)
+    if isinstance(img_output, str):
+        # image was too large to keep in memory
+        img_file = AutoRemoveFile(img_output)
+    else:
+        img_file = discord.File(io.BytesIO(img_output[1]), filename=os.path.basename(img_output[0]))
     timing_content = None
     if do_timing:
-        timing_content = f"JSON parse completed in {timing[0]:.3f}s.\n" \
+        timing_content = f"JSON parse completed in {timing[0]:.3f}s ({context.json_backend}).\n" \
             f"Conversion completed in {timing[1]:.3f}s.\n" \
             f"View matrices completed in {timing[3]:.3f}s.\n" \
             f"Image creation completed in {timing[4]:.3f}s.\n" \
-            f"Total time: {(timing[0]+timing[1]+timing[2]+timing[3]+timing[4]):.3f}s"
+            f"Image encoding completed in {timing[5]:.3f}s.\n" \
+            f"Total time: {sum(timing):.3f}s"
+        if context.peak_memory is not None:
+            timing_content += f"\nPeak memory: {context.peak_memory / 2**20:.1f} MB"
     return img_file, timing_content
 
 
@@ -1130,7 +1154,7 @@ async def process_message_attachments(message: discord.Message, invokemessage=No
             #try:
             combined_img_file, timing = await process_attachment(MessageOrInteraction(message), attachm, 
                     do_send_timing, use_player_colors=do_player_color,
-                    create_gif=do_create_gif, firing_order=do_random_firing_order, cut_side_top_front=do_cut_args,
+                    create_gif=do_create_gif is not None, firing_order=do_random_firing_order, cut_side_top_front=do_cut_args,
                     force_aspect_ratio=do_aspectratio_args)
                 #combined_img_file, timing = await bp_to_img.process_blueprint([filename, content],
                 #    use_player_colors=do_player_color, create_gif=do_create_gif, firing_order=do_random_firing_order,
@@ -1158,13 +1182,16 @@ async def process_message_attachments(message: discord.Message, invokemessage=No
     return bpcount
 
 
-async def handle_blueprint_error(moi: MessageOrInteraction, error, bpfilename: str, bpgameverison: str):
+async def handle_blueprint_error(moi: MessageOrInteraction, error, bpfilename: str, context: RenderContext | None):
     """Sends error notification to channel where message was received and error informations to bot owner."""
     def traceback_string():
         etype, value, tb = error
         exceptionList = traceback.format_exception_only(etype, value)
         tracebackList = traceback.extract_tb(tb)
         s = f"Traceback of `{bpfilename}` with game version {bpgameverison}:\n"
+        if isinstance(value, render_pool.RenderError):
+            # error happened in render worker process, local traceback is useless
+            return s + f"```{value.traceback[-1500:]}```"
         for elem in tracebackList:
             s += f"File `{elem.filename}`, line {elem.lineno}, in `{elem.name}`\n```{elem.line}```"
         for elem in exceptionList:
@@ -1174,6 +1201,7 @@ async def handle_blueprint_error(moi: MessageOrInteraction, error, bpfilename: s
     global bot
     # outdated game version warning
     warn_gv = ""
+    bpgameverison = None if context is None else context.gameversion
     if bpgameverison is None:
         bpgameverison = "?"
     else:
@@ -1196,4 +1224,20 @@ async def handle_blueprint_error(moi: MessageOrInteraction, error, bpfilename: s
     await moi.send(f"You found an error! Details were send to {ownerUser.name}." + warn_gv)
 
 
-bot.run(settings.TOKEN(), root_logger=True)
+# render worker processes import this module again, they must not run the bot
+if __name__ == "__main__":
+    GCM = guildconfig.GuildconfigManager()
+    RENDER_POOL = render_pool.RenderPool(settings.RENDER_PROCESSES, settings.RENDER_QUEUE_SIZE, settings.RENDER_TIMEOUT)
+    bot = commands.Bot(command_prefix = "bp!", intents=settings.get_bot_intents())
+    for event in [on_ready, on_guild_remove, on_message, on_command_error, on_reaction_add]:
+        bot.event(event)
+    for command in [cmd_print, cmd_mode, cmd_whycant, cmd_pptos, cmd_test, cmd_owner_perms, cmd_owner_mode,
+                    cmd_notify_deprecated]:
+        bot.add_command(command)
+    for context_menu in [cm_print, cm_gif, cm_interactive]:
+        bot.tree.add_command(context_menu)
+    try:
+        bot.run(settings.TOKEN(), root_logger=True)
+    finally:
+        # bot was closed, stop render workers
+        RENDER_POOL.close()
@@ -1,19 +1,28 @@
 #!/usr/bin/env python3.12
 
-import json
+import io
+import os
 import time
 import logging
-from collections import OrderedDict
+import functools
+import tracemalloc
+from collections import OrderedDict, deque
 from typing import Iterator, Annotated
 
 import numpy as np
 import quaternion
 import cv2
 from PIL import Image, ImageDraw, ImageFont
+import firing_animator
 from firing_animator import FiringAnimator
-import imageio
-from pygifsicle import optimize
-from scipy.signal import convolve2d
+import json_backend
+from gif_writer import GifPalette, GifWriter
+try:
+    import ijson  # optional, for streaming json ingestion
+    _stream_json_errors = (ijson.JSONError,)
+except ImportError:
+    ijson = None
+    _stream_json_errors = ()
 
 _log = logging.getLogger("bp_to_img")
 
@@ -75,27 +84,90 @@ rot_bitangent = np.cross(rot_normal, rot_tangent)
 rot_normal = rot_normal.T
 rot_tangent = rot_tangent.T
 rot_bitangent = rot_bitangent.T
+# rotation id by normal and tangent direction, directions are encoded as axis_weights @ direction + 3
+axis_weights = np.array([1, 2, 3])
+rotation_id_lookup = np.full((7, 7), -1, dtype=int)
+rotation_id_lookup[axis_weights @ rot_normal + 3, axis_weights @ rot_tangent + 3] = np.arange(24)
 
 # load blocks and materials configuration
-with open("blocks.json", "r") as f:
-    blocks = json.loads(f.read())
-with open("materials.json", "r") as f:
-    materials = json.loads(f.read())
+with open("blocks.json", "rb") as f:
+    blocks = json_backend.load(f)
+with open("materials.json", "rb") as f:
+    materials = json_backend.load(f)
+# load weapons with firing type (1 cannon, 2 laser, 3 particle, 4 flamethrower) and barrel flag for gif creation,
+# file order is the order in which shots of a sub blueprint are added to the animation
+with open("weapons.json", "rb") as f:
+    weapons = json_backend.load(f)
+weapon_order = {guid: i for i, guid in enumerate(weapons)}
 # add missing "Invisible" keys to materials
 for k in materials:
     if "Invisible" not in materials[k]:
         materials[k]["Invisible"] = False
     materials[k]["Color"] = np.array(materials[k]["Color"])
+# material index lookup and color by material index
+material_names = list(materials)
+material_index = {k: i for i, k in enumerate(material_names)}
+material_colors = np.array([materials[k]["Color"] for k in material_names], dtype=np.uint8)
 # load size id dictionary
-with open("size_id_dictionary.json", "r") as f:
-    size_id_dict = json.load(f)
+with open("size_id_dictionary.json", "rb") as f:
+    size_id_dict = json_backend.load(f)
 size_id_dict = {int(k): v for k, v in size_id_dict.items()}
-
-# store game version
-bp_gameversion = None
-
-# firing animator
-firing_animator = FiringAnimator()
+# up and forward extent by size id
+size_id_yp = np.zeros(max(size_id_dict) + 1, dtype=int)
+size_id_zp = np.zeros(max(size_id_dict) + 1, dtype=int)
+for sizeid, size in size_id_dict.items():
+    size_id_yp[sizeid] = size["yp"]
+    size_id_zp[sizeid] = size["zp"]
+# voxel offsets of each size id for all 24 block rotations, (24, K, 3) in x (bitan), y (tan), z (dir) step order
+voxel_offsets: dict[int, np.ndarray] = {}
+for sizeid, size in size_id_dict.items():
+    # here xp instead of xn as the negative x axis in game is the bitan direction
+    j, k, l = np.mgrid[-size["xp"]:size["xn"] + 1,
+                       -size["yn"]:size["yp"] + 1,
+                       -size["zn"]:size["zp"] + 1].reshape(3, 1, -1, 1)
+    offsets = j * rot_bitangent.T[:, np.newaxis] + k * rot_tangent.T[:, np.newaxis] + l * rot_normal.T[:, np.newaxis]
+    offsets.setflags(write=False)
+    voxel_offsets[sizeid] = offsets
+
+
+def parse_vectors(vectors: list[str], columns: int, dtype=np.int32) -> np.ndarray:
+    """Parse list of comma separated numbers ["x,y,z", ...] into (N, columns) array in one pass.
+    Values are parsed as floats, integer dtypes are rounded, so fractional components are accepted.
+    Already parsed arrays (see stream_blueprint) are passed through."""
+    if isinstance(vectors, np.ndarray):
+        return vectors.astype(dtype, copy=False)
+    if len(vectors) == 0:
+        return np.zeros((0, columns), dtype=dtype)
+    res = np.fromstring(",".join(vectors), dtype=np.float64, sep=",")
+    if len(res) != len(vectors) * columns:
+        raise ValueError(f"Expected {columns} values per vector, got {len(res)} values for {len(vectors)} vectors")
+    res = res.reshape(-1, columns)
+    if np.issubdtype(dtype, np.integer):
+        return res.round().astype(dtype)
+    return res.astype(dtype, copy=False)
+
+
+def peak_memory() -> int | None:
+    """Peak memory in bytes allocated by python and numpy since tracemalloc was started, None if not tracing.
+    Unlike the peak resident memory of the process, this does not depend on earlier renders in the same process."""
+    if not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.get_traced_memory()[1]
+
+
+class RenderContext:
+    """State of a single process_blueprint call, so multiple blueprints can be rendered at the same time."""
+    def __init__(self):
+        self.gameversion: list[int] | str | None = None
+        """game version of blueprint, None if not yet known"""
+        self.firing_animator: FiringAnimator | None = None
+        """collects shots for gif creation, only exists while rendering a gif"""
+        self.timings: list[float] = []
+        """seconds for: json parse, conversion, infos, view matrices, image creation, image encoding"""
+        self.json_backend: str | None = None
+        """json parser used for the blueprint file"""
+        self.peak_memory: int | None = None
+        """peak memory in bytes allocated during this render, None if memory was not traced (see peak_memory)"""
 
 # Blueprint:
 # CSI: block color (color shininess increase?)
@@ -110,80 +182,256 @@ firing_animator = FiringAnimator()
 
 # BlockIds: block ids [int]
 
+# streaming json ingestion
+STREAM_JSON_MIN_BYTES = 16 * 1024 * 1024  # automatically stream files larger than this
+STREAM_CHUNK_SIZE = 65536
+# in memory output, larger images are written to disk instead
+IN_MEMORY_MAX_BYTES = 24 * 1024 * 1024
+# blueprint arrays which are converted to numpy while streaming, with number of columns
+stream_array_columns = {"BLP": 3, "BLR": 1, "BlockIds": 1, "BCI": 1}
+
+
+def __stream_array(events: Iterator[tuple[str, any]], key: str) -> np.ndarray:
+    """Consume events of a flat json array and convert it chunk by chunk to a numpy array"""
+    columns = stream_array_columns[key]
+    def convert(chunk):
+        if columns == 1:
+            return np.array(chunk, dtype=np.int32)
+        return parse_vectors(chunk, columns)
+    chunks = []
+    chunk = []
+    for event, value in events:
+        if event == "end_array":
+            break
+        if event in ("start_map", "start_array", "map_key"):
+            raise ValueError(f"Unexpected nested data in '{key}'")
+        chunk.append(value)
+        if len(chunk) >= STREAM_CHUNK_SIZE:
+            chunks.append(convert(chunk))
+            chunk = []
+    chunks.append(convert(chunk))
+    return np.concatenate(chunks)
+
+
+def stream_blueprint(fp: io.RawIOBase | io.BufferedIOBase) -> dict:
+    """Parse blueprint json from binary file object with an incremental parser (requires ijson).
+
+    BLP, BLR, BlockIds and BCI of the blueprint and all sub blueprints (SCs) are converted to numpy
+    arrays as they arrive, so their python object tree never exists as a whole."""
+    if ijson is None:
+        raise ModuleNotFoundError("Streaming json ingestion requires ijson")
+    events = ijson.basic_parse(fp, use_float=True)
+    root = None
+    stack: list[dict | list] = []
+    key = None
+    def add(value):
+        nonlocal root
+        if len(stack) == 0:
+            root = value
+        elif type(stack[-1]) is list:
+            stack[-1].append(value)
+        else:
+            stack[-1][key] = value
+    for event, value in events:
+        if event == "map_key":
+            key = value
+        elif event == "start_map":
+            container = {}
+            add(container)
+            stack.append(container)
+        elif event == "start_array":
+            if len(stack) > 0 and type(stack[-1]) is dict and key in stream_array_columns:
+                add(__stream_array(events, key))
+            else:
+                container = []
+                add(container)
+                stack.append(container)
+        elif event == "end_map" or event == "end_array":
+            stack.pop()
+        else:
+            add(value)
+    return root
 
-async def process_blueprint(file: str | list[str | bytes], silent=False, standaloneMode=False, use_player_colors=True, create_gif=False,
-                            firing_order=2, cut_side_top_front:tuple[float|None, float|None, float|None]=(None, None, None), force_aspect_ratio=None):
-    """Load and init blueprint data. Returns blueprint, calculation times, image filename"""
-    global bp_gameversion, firing_animator
-    bp_gameversion = None
-    if not silent:
-        _log.info("Processing blueprint")
-    # parse file or bytes
-    ts1 = time.time()
+
+def __load_json(file: str | list[str | bytes], stream_json: bool | None) -> tuple[str, dict, str]:
+    """Load blueprint json from file name or [file name, bytes].
+    stream_json None streams if ijson is available and the file is large.
+    Returns file name, parsed json and name of used json parser."""
     if type(file) == str:
         fname = file
-        with open(fname, "r", encoding="utf-8") as f:
-            bp = json.load(f)
+        if stream_json is None:
+            stream_json = ijson is not None and os.path.getsize(fname) >= STREAM_JSON_MIN_BYTES
+        with open(fname, "rb") as f:
+            if stream_json:
+                try:
+                    return fname, stream_blueprint(f), "ijson"
+                except _stream_json_errors:
+                    # ijson is stricter than json (e.g. UTF-8 BOM or NaN), parse whole file instead
+                    f.seek(0)
+            return fname, json_backend.load(f), json_backend.BACKEND
     elif type(file) == list and len(file) == 2 \
     and type(file[0]) == str and type(file[1]) == bytes:#
         fname = file[0]
-        bp = json.loads(file[1])
-    else:
-        _log.error("ERROR: invalid file args passed")
-        raise FileNotFoundError()
+        if stream_json is None:
+            stream_json = ijson is not None and len(file[1]) >= STREAM_JSON_MIN_BYTES
+        if stream_json:
+            try:
+                return fname, stream_blueprint(io.BytesIO(file[1])), "ijson"
+            except _stream_json_errors:
+                # ijson is stricter than json (e.g. UTF-8 BOM or NaN), parse whole file instead
+                pass
+        return fname, json_backend.loads(file[1]), json_backend.BACKEND
+    _log.error("ERROR: invalid file args passed")
+    raise FileNotFoundError()
+
+
+def process_blueprint(file: str | list[str | bytes], silent=False, standaloneMode=False, use_player_colors=True, create_gif=False,
+                            firing_order=2, cut_side_top_front:tuple[float|None, float|None, float|None]=(None, None, None), force_aspect_ratio=None,
+                            context: RenderContext | None = None, stream_json: bool | None = None, in_memory=False,
+                            png_compression: int | None = None, png_quantize=False, max_image_bytes: int | None = None,
+                            gif_seed: int | None = None):
+    """Load blueprint and render its image or gif. Returns (image, calculation times), where image is
+    the filename of the written image, or [filename, bytes] with in_memory (see __in_memory_output).
+    standaloneMode returns (blueprint, calculation times, image array) instead, the image array is None for gifs.
+
+    This is blocking CPU work, the bot runs it in a worker process (see render_pool).
+    Game version and timings are stored in context as soon as they are known.
+    stream_json selects streaming json ingestion, None to stream only large files (see stream_blueprint).
+    in_memory keeps the encoded image or gif in memory and returns it as [filename, bytes] instead of writing it,
+    unless it is larger than IN_MEMORY_MAX_BYTES.
+    png_compression, png_quantize and max_image_bytes are passed to encode_image, not used for gifs.
+    gif_seed makes random firing order and flames of gifs reproducible.
+    Peak memory is only stored in context if the caller started tracemalloc (see render_pool)."""
+    if context is None:
+        context = RenderContext()
+    context.gameversion = None
+    context.timings = []
+    if not silent:
+        _log.info("Processing blueprint")
+    # parse file or bytes
+    ts1 = time.time()
+    fname, bp, context.json_backend = __load_json(file, stream_json)
     file = None  # free up space
     main_img_fname = fname.rsplit(".", 1)[0] + "_view"
     ts1 = time.time() - ts1
+    context.timings.append(ts1)
     if not silent:
-        _log.info(f"JSON parse completed in {ts1} s")
+        _log.info(f"JSON parse completed in {ts1} s using {context.json_backend}")
     # convert to numpy data
     ts2 = time.time()
     bp = Blueprint(bp)
     bp.convert_blueprint()
     ts2 = time.time() - ts2
+    context.timings.append(ts2)
     if not silent:
         _log.info(f"Conversion completed in {ts2} s")
     # fetch infos TODO remove this, not important
     ts3 = time.time()
-    bp_infos, bp_gameversion = bp.fetch_infos()
+    bp_infos, context.gameversion = bp.fetch_infos()
     ts3 = time.time() - ts3
+    context.timings.append(ts3)
     if not silent:
         _log.info(f"Infos gathered in {ts3} s")
     # create top, side, front view matrices
     ts4 = time.time()
-    firing_animator.clear()  # clear here and at the end (if it crashes)
+    context.firing_animator = FiringAnimator(gif_seed) if create_gif else None
     # TODO these should stay in the class (free when done using)
     top_mats, side_mats, front_mats = \
-        bp.create_view_matrices(use_player_colors=use_player_colors, create_gif=create_gif,
+        bp.create_view_matrices(use_player_colors=use_player_colors, firing_animator=context.firing_animator,
                                 cut_side_top_front=cut_side_top_front)
     ts4 = time.time() - ts4
+    context.timings.append(ts4)
     if not silent:
         _log.info(f"View matrices completed in {ts4} s")
     # create images
     ts5 = time.time()
     # TODO make a single call from this
     if create_gif:
-        main_img = __create_images(top_mats, side_mats, front_mats, bp_infos, gif_args=firing_animator,
-                                    firing_order=firing_order, file_name=main_img_fname, 
+        main_img_fname += ".gif"
+        gif_file = io.BytesIO() if in_memory else main_img_fname
+        main_img = __create_images(top_mats, side_mats, front_mats, bp_infos, gif_args=context.firing_animator,
+                                    firing_order=firing_order, gif_file=gif_file, 
                                     aspect_ratio=force_aspect_ratio)
     else:
         main_img = __create_images(top_mats, side_mats, front_mats, bp_infos, gif_args=None, 
                                     aspect_ratio=force_aspect_ratio)
     ts5 = time.time() - ts5
+    context.timings.append(ts5)
     if not silent:
         _log.info(f"Image creation completed in {ts5} s")
-    # save image
+    # encode and save image, gif is already encoded
+    ts6 = time.time()
     if not create_gif:
-        main_img_fname += ".png"
-        if not cv2.imwrite(main_img_fname, main_img):  # TODO: raise exception
-            _log.error("ERROR: image could not be saved %s", main_img_fname)
+        main_img_data, extension = encode_image(main_img, png_compression, png_quantize, max_image_bytes)
+        main_img_fname += extension
+        if not in_memory:
+            with open(main_img_fname, "wb") as f:
+                f.write(main_img_data)
     else:
-        main_img_fname += ".gif"
-        firing_animator.clear()
+        if in_memory:
+            main_img_data = gif_file.getvalue()
+            gif_file = None
+        context.firing_animator = None
+    ts6 = time.time() - ts6
+    context.timings.append(ts6)
+    if not silent:
+        _log.info(f"Image encoding completed in {ts6} s")
+    context.peak_memory = peak_memory()
+    if not silent and context.peak_memory is not None:
+        _log.info(f"Peak memory {context.peak_memory / 2**20:.1f} MB")
     if standaloneMode:
-        return bp, [ts1, ts2, ts3, ts4, ts5], main_img
+        return bp, context.timings, main_img
+    elif in_memory:
+        return __in_memory_output(main_img_fname, main_img_data), context.timings
     else:
-        return main_img_fname, [ts1, ts2, ts3, ts4, ts5]
+        return main_img_fname, context.timings
+
+
+def encode_png(img: np.ndarray, compression: int | None = None, quantize=False) -> bytes:
+    """Encodes BGR image as png. compression is the zlib level 0-9 (None for default),
+    quantize reduces the image to a 256 color palette."""
+    if quantize:
+        palette_img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)).quantize(
+            256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+        buffer = io.BytesIO()
+        palette_img.save(buffer, "PNG", compress_level=6 if compression is None else compression)
+        return buffer.getvalue()
+    params = [] if compression is None else [cv2.IMWRITE_PNG_COMPRESSION, compression]
+    success, data = cv2.imencode(".png", img, params)
+    if not success:
+        raise ValueError("Image could not be encoded as png")
+    return data.tobytes()
+
+
+def encode_image(img: np.ndarray, png_compression: int | None = None, png_quantize=False,
+                 max_bytes: int | None = None) -> tuple[bytes, str]:
+    """Encodes BGR image as png (see encode_png). If it is larger than max_bytes, lossless webp is used instead
+    or, if that is still too large, the image is halved in size until the png fits.
+    Returns encoded image and file extension."""
+    data = encode_png(img, png_compression, png_quantize)
+    if max_bytes is None or len(data) <= max_bytes:
+        return data, ".png"
+    # webp is limited to 16383 pixels per side
+    if max(img.shape[:2]) <= 16383:
+        success, webp_data = cv2.imencode(".webp", img, [cv2.IMWRITE_WEBP_QUALITY, 101])  # above 100 is lossless
+        if success and len(webp_data) <= max_bytes:
+            _log.info("Png of %d bytes exceeds %d bytes, using webp", len(data), max_bytes)
+            return webp_data.tobytes(), ".webp"
+    while len(data) > max_bytes and min(img.shape[:2]) > 1:
+        _log.info("Png of %d bytes exceeds %d bytes, downscaling %s", len(data), max_bytes, img.shape[:2])
+        img = cv2.resize(img, (img.shape[1] // 2, img.shape[0] // 2), interpolation=cv2.INTER_AREA)
+        data = encode_png(img, png_compression, png_quantize)
+    return data, ".png"
+
+
+def __in_memory_output(fname: str, data: bytes) -> str | list[str | bytes]:
+    """Returns [fname, data] or writes data to fname and returns fname if data is larger than IN_MEMORY_MAX_BYTES"""
+    if len(data) <= IN_MEMORY_MAX_BYTES:
+        return [fname, data]
+    _log.info("Image of %d bytes is written to disk", len(data))
+    with open(fname, "wb") as f:
+        f.write(data)
+    return fname
 
 type Guid = str
 
@@ -192,6 +440,21 @@ class Blueprint:
     def __init__(self, blueprint: dict):
         self._done_conversion = False
         self._force_disable_colors = False
+        # lookup tables by index of ItemDictionary id, see block_lookup_index
+        self.item_ids: np.ndarray = None
+        self.lookup_sizeid: np.ndarray = None
+        self.lookup_material: np.ndarray = None
+        self.lookup_color: np.ndarray = None
+        self.lookup_firing_type: np.ndarray = None
+        self.lookup_barrels: np.ndarray = None
+        self.lookup_weapon_order: np.ndarray = None
+        # blocks of blueprint and all sub blueprints, see convert_blueprint
+        self.block_ids: np.ndarray = None
+        self.block_positions: np.ndarray = None
+        self.block_rotations: np.ndarray = None
+        self.block_color_ids: np.ndarray = None
+        self.block_sc: np.ndarray = None
+        """index of sub blueprint in blueprint_iterator order"""
         self.name: str = blueprint.get("Name")
         self.saved_total_block_count = blueprint.get("SavedTotalBlockCount")
         self.saved_material_cost = blueprint.get("SavedMaterialCost")
@@ -249,11 +512,11 @@ class Blueprint:
             """Iterate through blueprint and sub blueprints.
             
             Yields layer name and blueprint dict, links 'ParentBlueprint' key to parent"""
-            queue:list[tuple[str, dict]] = [("0", self.blueprint)]
+            queue: deque[tuple[str, dict]] = deque([("0", self.blueprint)])
             for i in range(10000):
                 if len(queue) == 0:
                     break
-                desc, elem = queue.pop(0)
+                desc, elem = queue.popleft()
                 sub_blueprints = elem.get("SCs", [])
                 for k, sub in enumerate(sub_blueprints):
                     sub["ParentBlueprint"] = elem
@@ -264,9 +527,7 @@ class Blueprint:
 
 
     def __blueprint_conversion(self, blueprint: dict):
-        """Convert blueprint and sub blueprints"""
-        # convert rotation ids to np array
-        blueprint["BLR"] = np.array(blueprint["BLR"])
+        """Convert global rotation and global position of blueprint or sub blueprint"""
         # parent global rotation and global position
         parent_blueprint = blueprint.get("ParentBlueprint", {})
         parent_global_rotation = parent_blueprint.get("GlobalRotation", quaternion.one)
@@ -284,85 +545,99 @@ class Blueprint:
         localrot_max = np.sign(localrot[[0, 1, 2], localrot_arg])
         localrot[:, :] = 0
         localrot[[0, 1, 2], localrot_arg] = localrot_max
-        blueprint["LocalRotation"] = localrot
+        blueprint["LocalRotation"] = localrot.astype(int)
 
         # convert local position to np array
-        blueprint["LocalPosition"] = np.array(blueprint["LocalPosition"].split(","),
-                                            dtype=float).round().astype(int)
+        blueprint["LocalPosition"] = parse_vectors([blueprint["LocalPosition"]], 3, int)[0]
         blueprint["LocalPosition"] = (parent_global_rotation * quaternion.quaternion(*blueprint["LocalPosition"]) *
                                         parent_global_rotation.inverse()).vec.astype(int) + parent_global_position
-        # convert min/max coordinates to np array
-        mincoords = np.array(blueprint["MinCords"].split(","), dtype=float)
-        maxcoords = np.array(blueprint["MaxCords"].split(","), dtype=float)
-        # rotate
-        mincoords = (blueprint["LocalRotation"] @ mincoords) + blueprint["LocalPosition"]
-        maxcoords = (blueprint["LocalRotation"] @ maxcoords) + blueprint["LocalPosition"]
-        # (round to int) ((done after iteration))
-        #mincoords = mincoords  # .round().astype(int)
-        #maxcoords = maxcoords  # .round().astype(int)
-        # re-min/max
-        blueprint["MinCords"] = np.minimum(mincoords, maxcoords)
-        blueprint["MaxCords"] = np.maximum(mincoords, maxcoords)
-
-        # create new arrays
-        blockcount = blueprint["BlockCount"]
-        if blockcount != len(blueprint["BLP"]):
-            blockcount = len(blueprint["BLP"])
+
+        # check block count
+        if blueprint["BlockCount"] != len(blueprint["BLP"]):
             _log.warning("Block count is not equal to length of block position array.")
-        #blockguid_array = np.zeros(blockcount, dtype="<U36") not using guid here
-        blockid_array = np.array(blueprint["BlockIds"], dtype=int)
-        # block loop
-        for i in range(blockcount):
-            # blockguid_array[i] = self.item_dictionary[str(blueprint["BlockIds"][i])] not using guid here
-            blueprint["BLP"][i] = blueprint["BLP"][i].split(",")
-        # below does the same as the loop above, but way slower
-        #blueprint["BLP"] = np.vectorize(lambda x: np.array(x.split(","), dtype=float), signature="()->(n)")(blueprint["BLP"])
-
-        blueprint["BlockIds"] = blockid_array  # guid_array not using guid here
-
-        # rotate block position via local rotation and add local position
-        blueprint["BLP"] = np.array(blueprint["BLP"], dtype=float)
-        blockposition_array = np.dot(blueprint["LocalRotation"], blueprint["BLP"].T).T
-        blueprint["BLP"] = blockposition_array.round().astype(int) + blueprint["LocalPosition"]
-
-        # check min/max coords with blp
-        #mincoords = np.min(blueprint["BLP"], 0)
-        #maxcoords = np.max(blueprint["BLP"], 0)
-        #_log.debug(f"{mincoords} {maxcoords}")
-        #_log.debug(f"{blueprint["MinCords"]} {blueprint["MaxCords"]}")
-        # re-min/max
-        #blueprint["MinCords"] = np.minimum(mincoords, blueprint["MinCords"])
-        #blueprint["MaxCords"] = np.maximum(mincoords, blueprint["MaxCords"])
-
-        # rotate rot_normal, rot_tangent and rot_bitangent via local rotation
-        blueprint["RotNormal"] = np.dot(blueprint["LocalRotation"], rot_normal).T.round().astype(int)
-        blueprint["RotTangent"] = np.dot(blueprint["LocalRotation"], rot_tangent).T.round().astype(int)
-        blueprint["RotBitangent"] = np.dot(blueprint["LocalRotation"], rot_bitangent).T.round().astype(int)
+
+
+
+    def __create_lookup_tables(self):
+        """Create lookup tables from ItemDictionary id to size id, material index, color,
+        weapon firing type (0 for no weapon), barrel flag and weapon order.
+        Last entry of each table is for ids which are not in ItemDictionary."""
+        self.item_ids = np.array(sorted(self.item_dictionary), dtype=int)
+        missing_block = blocks.get("missing")
+        guids = [self.item_dictionary[item_id] for item_id in self.item_ids]
+        block_list = [blocks.get(guid, missing_block) for guid in guids] + [missing_block]
+        self.lookup_sizeid = np.array([block.get("SizeId") for block in block_list], dtype=np.uint8)
+        self.lookup_material = np.array([material_index.get(block.get("Material"), material_index["Missing"])
+                                         for block in block_list], dtype=np.uint16)
+        self.lookup_color = material_colors[self.lookup_material]
+        weapon_list = [weapons.get(guid, {}) for guid in guids] + [{}]
+        self.lookup_firing_type = np.array([weapon.get("FiringType", 0) for weapon in weapon_list], dtype=np.uint8)
+        self.lookup_barrels = np.array([weapon.get("Barrels", False) for weapon in weapon_list], dtype=bool)
+        self.lookup_weapon_order = np.array([weapon_order.get(guid, len(weapon_order)) for guid in guids]
+                                            + [len(weapon_order)], dtype=np.int32)
+
+
+    def block_lookup_index(self, block_ids: np.ndarray) -> np.ndarray:
+        """Convert block ids to index for lookup tables"""
+        if len(self.item_ids) == 0:
+            return np.zeros(len(block_ids), dtype=int)
+        index = np.searchsorted(self.item_ids, block_ids)
+        index[index >= len(self.item_ids)] = len(self.item_ids)
+        unknown = self.item_ids[np.minimum(index, len(self.item_ids) - 1)] != block_ids
+        index[unknown] = len(self.item_ids)
+        return index
 
 
     def convert_blueprint(self):
-        """Convert data to numpy data"""
-        res = {}
+        """Convert data to numpy data.
+
+        Blocks of blueprint and all sub blueprints are merged into the flat block_* arrays,
+        with positions and rotation ids transformed to the main blueprint."""
         # item dictionary conversion
         self.item_dictionary = {int(k): v for k, v in self.item_dictionary.items()}
+        self.__create_lookup_tables()
         # main bp fix
         self.blueprint["LocalRotation"] = "0,0,0,1"
         self.blueprint["LocalPosition"] = "0,0,0"
+        sub_blueprints = []
         for desc, blueprint in self.blueprint_iterator():
             self.__blueprint_conversion(blueprint)
-            # track min/max coords
-            self.blueprint["MinCords"] = np.minimum(self.blueprint["MinCords"], blueprint["MinCords"])
-            self.blueprint["MaxCords"] = np.maximum(self.blueprint["MaxCords"], blueprint["MaxCords"])
+            sub_blueprints.append(blueprint)
+        # transforms of blueprint and sub blueprints
+        sc_rotation = np.array([blueprint["LocalRotation"] for blueprint in sub_blueprints])
+        sc_position = np.array([blueprint["LocalPosition"] for blueprint in sub_blueprints])
+        # rotation id after applying sub blueprint rotation, for all 24 rotation ids
+        sc_rotation_id = rotation_id_lookup[axis_weights @ (sc_rotation @ rot_normal) + 3,
+                                            axis_weights @ (sc_rotation @ rot_tangent) + 3]
+
+        # min/max coords of all sub blueprints, rotated and moved
+        bounds = parse_vectors([coords for blueprint in sub_blueprints
+                                for coords in (blueprint["MinCords"], blueprint["MaxCords"])], 3, float).reshape(-1, 2, 3)
+        bounds = (sc_rotation[:, np.newaxis] @ bounds[..., np.newaxis])[..., 0] + sc_position[:, np.newaxis]
         # set size
-        self.blueprint["MinCords"] = self.blueprint["MinCords"].round().astype(int)
-        self.blueprint["MaxCords"] = self.blueprint["MaxCords"].round().astype(int)
+        self.blueprint["MinCords"] = np.amin(bounds, (0, 1)).round().astype(int)
+        self.blueprint["MaxCords"] = np.amax(bounds, (0, 1)).round().astype(int)
         self.blueprint["Size"] = self.blueprint["MaxCords"] - self.blueprint["MinCords"] + 1
+
+        # merge blocks, the per sub blueprint arrays are not needed anymore
+        block_counts = [len(blueprint["BLP"]) for blueprint in sub_blueprints]
+        self.block_sc = np.repeat(np.arange(len(sub_blueprints)), block_counts)
+        self.block_ids = np.concatenate([np.asarray(blueprint.pop("BlockIds"), dtype=int)
+                                         for blueprint in sub_blueprints])
+        self.block_color_ids = np.concatenate([np.asarray(blueprint.pop("BCI"), dtype=int)
+                                               for blueprint in sub_blueprints])
+        block_rotations = np.concatenate([np.asarray(blueprint.pop("BLR"), dtype=int)
+                                          for blueprint in sub_blueprints])
+        block_positions = np.concatenate([parse_vectors(blueprint.pop("BLP"), 3)
+                                          for blueprint in sub_blueprints])
+        # rotate block positions via local rotation and add local position, in one batched matmul
+        self.block_positions = (sc_rotation[self.block_sc] @ block_positions[:, :, np.newaxis])[:, :, 0] + \
+                                sc_position[self.block_sc]
+        self.block_rotations = sc_rotation_id[self.block_sc, block_rotations]
+
         # player colors
-        #color_array = np.vectorize(lambda x: np.array(str.split(x, ",")).astype(float),signature="()->(n)")(self.blueprint["COL"])
         if self.blueprint.get("COL") is not None:
-            for i in range(len(self.blueprint["COL"])):
-                self.blueprint["COL"][i] = self.blueprint["COL"][i].split(",")
-            color_array = np.array(self.blueprint["COL"], dtype=float)
+            color_array = parse_vectors(self.blueprint["COL"], 4, float)
             # early alpha blending
             self.blueprint["COL"] = (255 * color_array[:, 2::-1] * color_array[:, np.newaxis, 3]).astype(np.uint8)
             self.blueprint["ONE_MINUS_ALPHA"] = 1. - color_array[:, 3]
@@ -426,350 +701,316 @@ class Blueprint:
         return infos, gameversion
 
 
-    def create_view_matrices(self, use_player_colors=True, create_gif=True, 
+    def create_view_matrices(self, use_player_colors=True, firing_animator: FiringAnimator | None = None,
                 cut_side_top_front=(None, None, None)) -> tuple[list[np.typing.ArrayLike], list[np.typing.ArrayLike], list[np.typing.ArrayLike]]:
-        """Create top, side, front view matrices (color matrix and height matrix)"""
-        def blueprint_iter(blueprint, mincoords, blueprint_desc = "main") -> bool:
-            """Iterate blueprint and sub blueprints.
-            
-            Returns False if IndexError occurred and min/max coords updated."""
-            nonlocal actual_min_coords, actual_max_coords
-            global firing_animator
-            # subtract min coords
-            blueprint["BLP"] -= mincoords
-            #_log.info("ViewMat at %s", blueprint_desc)
-
-            # numpyfication
-            # vectorize is slower
-            #a_guid = np.vectorize(self.item_dictionary.get, otypes=["<U36"])(blueprint["BlockIds"])
-            a_guid = np.zeros((len(blueprint["BlockIds"])), dtype="<U36")
-            for i in range(len(a_guid)):
-                a_guid[i] = self.item_dictionary.get(blueprint["BlockIds"][i])
-            missing_block = blocks.get("missing")
-            # new version
-            #a_sizeid = np.vectorize(lambda x: blocks.get(x, missing_block).get("SizeId"), otypes=[np.uint8])(a_guid)
-            a_sizeid = np.zeros((len(a_guid)), dtype=np.uint8)
-            for i in range(len(a_guid)):
-                a_sizeid[i] = blocks.get(a_guid[i], missing_block).get("SizeId")
-            # end new
-            a_pos = blueprint["BLP"]
-            a_dir = blueprint["RotNormal"][blueprint["BLR"]]
-            a_dir_tan = blueprint["RotTangent"][blueprint["BLR"]]
-            a_dir_bitan = blueprint["RotBitangent"][blueprint["BLR"]]
-            #a_material = np.vectorize(lambda x: blocks.get(x, missing_block).get("Material"))(a_guid)
-            #a_color = np.vectorize(lambda x: materials.get(x)["Color"], signature="()->(n)")(a_material)
-            #a_invisible = np.vectorize(lambda x: materials.get(x)["Invisible"])(a_material)  # unused
-            a_color = np.zeros((len(a_guid), 3), dtype=np.uint8)
-            for i in range(len(a_guid)):
-                a_color[i] = materials.get(blocks.get(a_guid[i], missing_block).get("Material"))["Color"]
+        """Create top, side, front view matrices (color matrix, height matrix and coverage matrix)
+        
+        Shots for gif creation are appended to firing_animator, if given."""
+        def expand_voxels() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+            """Expand blocks of blueprint and sub blueprints to voxels.
+
+            Returns voxel positions, voxel colors and voxel sub blueprint index.
+            Drawing order is by sub blueprint, then size id, then voxel offset, then block."""
+            # numpyfication via lookup tables
+            a_lookup = self.block_lookup_index(self.block_ids)
+            a_sizeid = self.lookup_sizeid[a_lookup]
+            a_pos = self.block_positions
+            a_color = self.lookup_color[a_lookup]
 
             # find missing blocks
-            #for i in range(len(a_guid)):
-            #    block = blocks.get(a_guid[i])
+            #for block_id in np.unique(self.block_ids[self.lookup_material[a_lookup] == material_index["Missing"]]):
+            #    guid = self.item_dictionary.get(int(block_id), "None")
+            #    block = blocks.get(guid)
             #    if block is None:
-            #        _log.warning(f"Unknown missing block: '{a_guid[i]}'")
-            #    elif block["Material"] == missing_block["Material"]:
-            #        _log.warning(f"Missing block: '{a_guid[i]}'\nwith name: '{block['Name']}'")
-
-            if create_gif:
-                blocks_that_go_bang = [ "c94e1719-bcc7-4c6a-8563-505fad2f9db9",  # 16 pounder
-                                        "58305289-16ea-43cf-9144-2f23b383da81",  # 32 pounder
-                                        "e1d1bcae-f5e4-42bb-9781-6dde51b8e390",  # 64 pounder
-                                        "16b67fbc-25d5-4a35-a0df-4941e7abf6ef",  # Revolving Blast-Gun
-                                        "d3e8e14a-58e7-4bdd-b1b3-0f37e4723a73",  # Shard cannon
-                                        #"7101e1cb-a501-49bd-8bbe-7a960881e72b",  # .50 AA Gun
-                                        #"b92a4ce6-ea93-4c0c-97d7-494ea611caa9",  # 20mm AA gun
-                                        #"d8c5639a-ff5f-448e-a761-c2f69fac661a",  # 40mm Quad AA Gun
-                                        #"268d79bf-c266-48ed-b01b-76c8d4d31c92",  # 40mm Twin AA Gun
-                                        #"3be0cab1-643b-4e3a-9f49-45995e4eb9fb",  # 40mm Octuple AA Gun
-                                        "2311e4db-a281-448f-ad53-0a6127573a96",  # 60mm Grenade Launcher
-                                        "742f063f-d0fe-4f41-8717-a2c75c38d5e0",  # 30mm Assault Cannon
-                                        "9b8657b9-c820-43a0-ad19-25ea45a100f1",  # 60mm Auto Cannon
-                                        "f9f36cb3-cbfd-446a-9313-40f8e31e6e89",  # 3.7" Gun
-                                        "1217043c-e786-4555-ba24-46cd1f458bf9",  # 3.7" Gun Shield
-                                        "0aa0fa2e-1a85-4493-9c4c-0a69c385395d",  # 130mm Casemate
-                                        "aa070f63-c454-4f95-82fd-d946a32a1b66"   # 150mm Casemate
-                                        ]
-                blocks_that_go_brrr = [ "5cf2b4da-c1b8-4005-930b-73cc39ac9d28"  # (Simple) Laser
-                                        ]
-                blocks_that_go_woosh = ["2fd4fd83-3125-4825-b596-f78ef36375c2",  # Flamethrower Back
-                                        "a5ad3190-f3ff-4cfd-860a-9f7328482271"   # Flamethrower Bottom
-                                        ]
-                blocks_with_barrels_that_go_bang = ["dc8f69fe-f97c-404f-996c-1b934afa17b5",  # Adv. Firing piece
-                                                    "a97e03b0-e8da-49e2-9913-ad8c1826d869"  # Firing piece
-                                                    ]
-                blocks_with_barrels_that_go_brrr = ["fd2b6afb-da6f-4a8e-bfc0-e4202b87300d",  # Short range laser combiner
-                                                    "7dc67bed-fd0f-4145-9525-5840bbcc4822"  # Laser combiner
-                                                    ]
-                blocks_with_barrels_that_go_zap = [ "9896747c-39a5-43bc-8ba9-ccf2f645cca1",  # PAC lens (symmetric)
-                                                    "1a1c9de5-6db5-4092-97ac-a4883383fadd",  # Small PAC lens (cross inputs)
-                                                    "2e429412-2982-4335-bf3c-a6c6609c8cbf",  # Small PAC lens (rear inputs)
-                                                    "2eea241a-6a32-41c6-a9e4-d082c7e854de",  # PAC lens (rear inputs)
-                                                    "f1746662-adec-4054-98bd-94b553bc6c6d",  # Particle Accelerator Lens
-                                                    #"2099a233-181e-4f50-9a0e-78a547969a8e",  # Particle Melee Lens
-                                                    "3d82f1a3-ad2a-4e81-a4e3-cb88c968f6e9",  # Particle Cannon
-                                                    ]
-                simple_cannons_firing_type_blocks = [(1, blocks_that_go_bang), (2, blocks_that_go_brrr), (4, blocks_that_go_woosh)]
-                barrels_firing_type_blocks = [(1, blocks_with_barrels_that_go_bang), (2, blocks_with_barrels_that_go_brrr), (3, blocks_with_barrels_that_go_zap)]
-                largest_axis = np.argmax(self.blueprint["Size"])
-                # simple cannons loop
-                for firing_type, blocks_simple in simple_cannons_firing_type_blocks:
-                    for cannon_guid in blocks_simple:
-                        cannon, = np.nonzero(a_guid == cannon_guid)
-                        if len(cannon) > 0:
-                            firing_pos = a_pos[cannon] + a_dir_tan[cannon] * size_id_dict[a_sizeid[cannon[0]]]["yp"] + \
-                                a_dir[cannon] * (size_id_dict[a_sizeid[cannon[0]]]["zp"] + 1)
-                            firing_animator.append(firing_pos, a_dir[cannon], np.full(len(cannon), firing_type, dtype=np.uint8))
-                # cannons with barrels marching loop
-                for firing_type, blocks_with_barrels in barrels_firing_type_blocks:
-                    for cannon_guid in blocks_with_barrels:
-                        cannon, = np.nonzero(a_guid == cannon_guid)
-                        if len(cannon) > 0:
-                            firing_pos = a_pos[cannon] + a_dir_tan[cannon] * (size_id_dict[a_sizeid[cannon[0]]]["yp"] // 2) + \
-                                a_dir[cannon] * (size_id_dict[a_sizeid[cannon[0]]]["zp"] + 1)
-                            barrel_end_firing_pos = np.empty(firing_pos.shape, dtype=firing_pos.dtype)
-                            for i in range(len(firing_pos)):
-                                slicer = np.index_exp[largest_axis, (largest_axis + 1) % 3, (largest_axis + 2) % 3]
-                                iter_count = 0
-                                while iter_count < 100:
-                                    iter_count += 1
-                                    # search the largest axis in hopes of getting less false hits
-                                    index_largest, = np.nonzero(a_pos[:, slicer[0]] == firing_pos[i, slicer[0]])
-                                    if len(index_largest) < 1:
-                                        break
-                                    index_a, = np.nonzero(a_pos[index_largest, slicer[1]] == firing_pos[i, slicer[1]])
-                                    if len(index_a) < 1:
-                                        break
-                                    index_b, = np.nonzero(a_pos[index_largest[index_a], slicer[2]] == firing_pos[i, slicer[2]])
-                                    if len(index_b) < 1:
-                                        break
-                                    final_index = index_largest[index_a[index_b]][0]
-                                    if blocks.get(a_guid[final_index], missing_block).get("Material") == "Missing":
-                                        break
-                                    firing_pos[i] += (size_id_dict[a_sizeid[final_index]]["zp"] + 1) * a_dir[final_index]
-                                barrel_end_firing_pos[i] = firing_pos[i]
-                            firing_animator.append(barrel_end_firing_pos, a_dir[cannon], np.full(len(cannon), firing_type, dtype=np.uint8))
-
-            # player colors
-            if use_player_colors and not self._force_disable_colors:
-                a_block_color = self.blueprint["COL"][blueprint["BCI"]]
-                a_block_one_minus_alpha = self.blueprint["ONE_MINUS_ALPHA"][blueprint["BCI"]][:, np.newaxis]
-
-            def fill_color_and_height(color_mat, height_mat, sel_arr, pos_sel_arr, axisX, axisZ, axisY):
-                """Fills color_mat and height_mat with selected blocks (sel_arr as index and pos_sel_arr as position).
-                axisY is the height axis.
-                Raises IndexError when position is out of bounds."""
-                nonlocal a_color#, a_invisible  # unused
-                # create slicing indices for axes
-                axisA = axisX
-                axisB = axisZ+1 if axisZ > axisX else None
-                axisS = axisZ - axisX
-
-                # selection of higher height
-                if height_mat.shape[0] <= np.max(pos_sel_arr[:, axisX]):
-                    errortext = f"Axis overflow: {height_mat.shape[0]} to {np.max(pos_sel_arr[:, axisX])}\n" \
-                                f"Block guid: {a_guid[sel_arr[np.argmax(pos_sel_arr[:, axisX])]]}"
-                    raise IndexError(errortext)
-                if height_mat.shape[1] <= np.max(pos_sel_arr[:, axisZ]):
-                    errortext = f"Axis overflow: {height_mat.shape[1]} to {np.max(pos_sel_arr[:, axisZ])}\n" \
-                                f"Block guid: {a_guid[sel_arr[np.argmax(pos_sel_arr[:, axisZ])]]}"
-                    raise IndexError(errortext)
-
-
-                # height filter
-                height_sel_arr = height_mat[pos_sel_arr[:, axisX], pos_sel_arr[:, axisZ]] < pos_sel_arr[:, axisY]
-                # cut through filter
-                if cut_side_top_front[axisY] is not None:
-                    height_sel_arr = np.logical_and(height_sel_arr, pos_sel_arr[:, axisY] <
-                                                    self.blueprint["Size"][axisY] * cut_side_top_front[axisY])
-                # position of selection
-                height_pos_sel_arr = pos_sel_arr[height_sel_arr]
-
-                # select only max height for each x,z coord
-                # sort index of heights
-                sorted_index = np.argsort(height_pos_sel_arr[:, axisY], axis=0)[::-1]
-                # sort pos
-                sorted_pos = height_pos_sel_arr[sorted_index]
-                # find index of unique (x,z) coords
-                unique_pos, unique_index = np.unique(sorted_pos[:, axisA:axisB:axisS], return_index=True, axis=0)
-
-                # coloring
-                if use_player_colors and not self._force_disable_colors:
-                    color_mat[unique_pos[:, 0], unique_pos[:, 1]] = a_color[sel_arr][height_sel_arr][sorted_index][unique_index] * a_block_one_minus_alpha[sel_arr][height_sel_arr][sorted_index][unique_index]
-                    # player color
-                    color_mat[unique_pos[:, 0], unique_pos[:, 1]] += a_block_color[sel_arr][height_sel_arr][sorted_index][unique_index]
-                else:
-                    color_mat[unique_pos[:, 0], unique_pos[:, 1]] = a_color[sel_arr][height_sel_arr][sorted_index][unique_index]
-                # new height
-                height_mat[unique_pos[:, 0], unique_pos[:, 1]] = sorted_pos[:, axisY][unique_index]
+            #        _log.warning(f"Unknown missing block: '{guid}'")
+            #    else:
+            #        _log.warning(f"Missing block: '{guid}'\nwith name: '{block['Name']}'")
 
-            # flag if fill_color_and_height raised an index error, stops fill_color_and_height from beeing called and returns False at end
-            index_error_occured = False
-            # positiv size
+            # block colors
+            if use_player_colors and not self._force_disable_colors:
+                a_block_one_minus_alpha = self.blueprint["ONE_MINUS_ALPHA"][self.block_color_ids][:, np.newaxis]
+                a_color = (a_color * a_block_one_minus_alpha).astype(np.uint8)
+                # player color
+                a_color += self.blueprint["COL"][self.block_color_ids]
+
+            # voxel expansion
+            voxel_pos = []
+            voxel_color = []
+            voxel_sc = []
             for sizeid in size_id_dict:
                 # block selection
                 a_sel, = np.nonzero(a_sizeid == sizeid)
                 if len(a_sel) == 0:
                     continue
-                a_pos_sel = a_pos[a_sel]
-
-                # load size
-                xp = size_id_dict[sizeid]["xp"]
-                yp = size_id_dict[sizeid]["yp"]
-                zp = size_id_dict[sizeid]["zp"]
-                xn = size_id_dict[sizeid]["xn"]
-                yn = size_id_dict[sizeid]["yn"]
-                zn = size_id_dict[sizeid]["zn"]
-                size_x = xp + xn
-                size_y = yp + yn
-                size_z = zp + zn
-
-                # initial position
-                a_pos_sel -= zn * a_dir[a_sel] + yn * a_dir_tan[a_sel] + xp * a_dir_bitan[a_sel]  # here xp instead ...
-                # ... of xn as the negative x axis in game is the bitan direction here
-                a_z_times_dir = a_dir[a_sel] * size_z
-                a_y_times_dir = a_dir_tan[a_sel] * size_y
-
-                # volume loop
-                for j in range(size_x + 1):
-                    for k in range(size_y + 1):
-                        for l in range(size_z + 1):
-                            # select position here as loop changes a_pos
-                            #a_pos_sel = a_pos[a_sel]
-                            # fill if no index error occured, else just continue to calculate min/max coords
-                            if not index_error_occured:
-                                try:
-                                    fill_color_and_height(top_color, top_height, a_sel, a_pos_sel, 0, 2, 1)
-                                    fill_color_and_height(side_color, side_height, a_sel, a_pos_sel, 1, 2, 0)
-                                    fill_color_and_height(front_color, front_height, a_sel, a_pos_sel, 1, 0, 2)
-                                except IndexError as err:
-                                    _log.warning(str(err))
-                                    index_error_occured = True
-                            # min and max coords
-                            actual_min_coords = np.minimum(np.amin(a_pos_sel, 0), actual_min_coords)
-                            actual_max_coords = np.maximum(np.amax(a_pos_sel, 0), actual_max_coords)
-                            # step in z direction (dir)
-                            if l < size_z:
-                                a_pos_sel += a_dir[a_sel]
-                        # reset z axis
-                        a_pos_sel -= a_z_times_dir
-                        # step in y direction (tan)
-                        if k < size_y:
-                            a_pos_sel += a_dir_tan[a_sel]
-                    # reset y axis
-                    a_pos_sel -= a_y_times_dir
-                    # step in x direction (bitan)
-                    if j < size_x:
-                        a_pos_sel += a_dir_bitan[a_sel]
-
-            return (not index_error_occured)
+                # offsets of size id selected by block rotation
+                offsets = voxel_offsets[sizeid]
+                voxels = a_pos[a_sel] + offsets[self.block_rotations[a_sel]].swapaxes(0, 1)
+                voxel_pos.append(voxels.reshape(-1, 3))
+                voxel_color.append(np.tile(a_color[a_sel], (offsets.shape[1], 1)))
+                voxel_sc.append(np.tile(self.block_sc[a_sel], offsets.shape[1]))
+
+            if len(voxel_pos) == 0:
+                return np.zeros((0, 3), dtype=int), np.zeros((0, 3), dtype=np.uint8), np.zeros(0, dtype=int)
+            return np.concatenate(voxel_pos), np.concatenate(voxel_color), np.concatenate(voxel_sc)
+
+        def append_shots(mincoords):
+            """Append firing positions of weapons in blueprint and sub blueprints to firing_animator"""
+            # numpyfication via lookup tables
+            a_lookup = self.block_lookup_index(self.block_ids)
+            a_sizeid = self.lookup_sizeid[a_lookup]
+            a_pos = self.block_positions - mincoords
+            a_dir = rot_normal.T[self.block_rotations]
+            a_dir_tan = rot_tangent.T[self.block_rotations]
+            a_firing_type = self.lookup_firing_type[a_lookup]
+            a_barrels = self.lookup_barrels[a_lookup]
+
+            # simple cannons
+            simple_cannon, = np.nonzero((a_firing_type > 0) & ~a_barrels)
+            simple_firing_pos = a_pos[simple_cannon] + \
+                a_dir_tan[simple_cannon] * size_id_yp[a_sizeid[simple_cannon], np.newaxis] + \
+                a_dir[simple_cannon] * (size_id_zp[a_sizeid[simple_cannon], np.newaxis] + 1)
+            # cannons with barrels
+            cannon, = np.nonzero((a_firing_type > 0) & a_barrels)
+            firing_pos = a_pos[cannon] + a_dir_tan[cannon] * (size_id_yp[a_sizeid[cannon], np.newaxis] // 2) + \
+                a_dir[cannon] * (size_id_zp[a_sizeid[cannon], np.newaxis] + 1)
+            if len(cannon) > 0:
+                march_barrels(cannon, firing_pos, a_lookup, a_sizeid, a_pos, a_dir)
+            # shots per sub blueprint, by weapon order and block order, firing order depends on it for equal positions
+            cannon = np.concatenate((simple_cannon, cannon))
+            firing_pos = np.concatenate((simple_firing_pos, firing_pos))
+            order = np.lexsort((cannon, self.lookup_weapon_order[a_lookup[cannon]], self.block_sc[cannon]))
+            firing_animator.append(firing_pos[order], a_dir[cannon[order]], a_firing_type[cannon[order]])
+
+        def march_barrels(cannon, firing_pos, a_lookup, a_sizeid, a_pos, a_dir):
+            """Moves firing positions of cannons to the end of their barrels"""
+            # occupancy index of blocks, sorted linearized (sub blueprint, position) keys
+            index_shape = (np.max(self.block_sc) + 1, *self.blueprint["Size"])
+            block_keys = np.ravel_multi_index((self.block_sc, *a_pos.T), index_shape)
+            key_order = np.argsort(block_keys, kind="stable")
+            block_keys = block_keys[key_order]
+            # march all barrels at once, a barrel ends at the first empty position or missing block
+            marching, = np.nonzero(np.all((firing_pos >= 0) & (firing_pos < self.blueprint["Size"]), axis=1))
+            for _ in range(100):
+                marching_keys = np.ravel_multi_index((self.block_sc[cannon[marching]], *firing_pos[marching].T), index_shape)
+                key_index = np.minimum(np.searchsorted(block_keys, marching_keys), len(block_keys) - 1)
+                hit = block_keys[key_index] == marching_keys
+                barrel = key_order[key_index[hit]]
+                marching = marching[hit]
+                not_missing = self.lookup_material[a_lookup[barrel]] != material_index["Missing"]
+                barrel = barrel[not_missing]
+                marching = marching[not_missing]
+                if len(marching) == 0:
+                    break
+                firing_pos[marching] += (size_id_zp[a_sizeid[barrel]] + 1)[:, np.newaxis] * a_dir[barrel]
+                marching = marching[np.all((firing_pos[marching] >= 0) & (firing_pos[marching] < self.blueprint["Size"]), axis=1)]
+
+        def fill_color_and_height(color_mat, height_mat, coverage_mat, voxel_pos, voxel_color, voxel_sc, axisX, axisZ, axisY):
+            """Fills color_mat, height_mat and coverage_mat with the highest voxel of each (x,z) coord.
+            Earlier voxels in drawing order win on equal height. axisY is the height axis."""
+            # cut through filter
+            if cut_side_top_front[axisY] is not None:
+                cut_sel = voxel_pos[:, axisY] < self.blueprint["Size"][axisY] * cut_side_top_front[axisY]
+                voxel_pos = voxel_pos[cut_sel]
+                voxel_color = voxel_color[cut_sel]
+                voxel_sc = voxel_sc[cut_sel]
+            if len(voxel_pos) == 0:
+                return
+            height = voxel_pos[:, axisY]
+
+            # drawing order, sub blueprint first
+            count = len(voxel_pos)
+            order = voxel_sc.astype(np.int64) * count + np.arange(count)
+            max_order = int(np.max(order))
+            order_bits = max_order.bit_length()
+            # scatter max of key, high bits are height, low bits inverted drawing order
+            lin = np.ravel_multi_index((voxel_pos[:, axisX], voxel_pos[:, axisZ]), height_mat.shape)
+            key = (height - np.min(height)).astype(np.int64) << order_bits
+            key |= max_order - order
+            max_key = np.full(height_mat.size, -1, dtype=np.int64)
+            np.maximum.at(max_key, lin, key)
+            filled, = np.nonzero(max_key >= 0)
+            winner = (max_order - (max_key[filled] & ((1 << order_bits) - 1))) % count
+
+            color_mat.reshape(-1, 3)[filled] = voxel_color[winner]
+            height_mat.reshape(-1)[filled] = height[winner]
+            coverage_mat.reshape(-1)[filled] = 1
 
         if not self._done_conversion:
             raise RuntimeError("Blueprint was not converted. Call convert_blueprint() first.")
-        
-        # MAX TWO tries at filling blueprint, first try should get correct min/max coords
-        for iter_i in range(2):
-            # calculate min/max coords again, cause "MinCords" are not always true
-            actual_min_coords = np.full((3), np.iinfo(np.int32).max, dtype=np.int32)
-            actual_max_coords = np.full((3), np.iinfo(np.int32).min, dtype=np.int32)
-            # create matrices
-            top_color = np.full((*self.blueprint["Size"][[0, 2]], 3), np.array([255, 118, 33]), dtype=np.uint8)
-            top_height = np.full(self.blueprint["Size"][[0, 2]], -12345, dtype=int)
-            side_color = np.full((*self.blueprint["Size"][[1, 2]], 3), np.array([255, 118, 33]), dtype=np.uint8)
-            side_height = np.full(self.blueprint["Size"][[1, 2]], -12345, dtype=int)
-            front_color = np.full((*self.blueprint["Size"][[1, 0]], 3), np.array([255, 118, 33]), dtype=np.uint8)
-            front_height = np.full(self.blueprint["Size"][[1, 0]], -12345, dtype=int)
-            # blueprint iteration
-            bp_iter_success = True
-            for desc, elem in self.blueprint_iterator():
-                bp_iter_success &= blueprint_iter(elem, self.blueprint["MinCords"], "main:"+desc)
-            if bp_iter_success:
-                break
-            _log.info(f"Applying min coord shift by {actual_min_coords}")
-            self.blueprint["MinCords"] = actual_min_coords  # "MinCords" have been subtracted from "BLP"
-            new_bp_size = actual_max_coords - actual_min_coords + 1
-            _log.info(f"Setting blueprint size from {self.blueprint["Size"]} to {new_bp_size}")
-            self.blueprint["Size"] = new_bp_size
-
-        # re-center based on actual min coordinates (should never happen after iterating twice)
-        if np.any(actual_min_coords < 0): #self.blueprint["MinCords"]):  # this seems wrong, as actual_min_cords are shifted by MinCords
-            _log.debug(f"Calculated new min coords {actual_min_coords} old {self.blueprint["MinCords"]}")
-            top_color = np.roll(top_color, (-actual_min_coords[0], -actual_min_coords[2]), (0, 1))
-            top_height = np.roll(top_height, (-actual_min_coords[0], -actual_min_coords[2]), (0, 1))
-            side_color = np.roll(side_color, (-actual_min_coords[1], -actual_min_coords[2]), (0, 1))
-            side_height = np.roll(side_height, (-actual_min_coords[1], -actual_min_coords[2]), (0, 1))
-            front_color = np.roll(front_color, (-actual_min_coords[1], -actual_min_coords[0]), (0, 1))
-            front_height = np.roll(front_height, (-actual_min_coords[1], -actual_min_coords[0]), (0, 1))
+
+        voxel_pos, voxel_color, voxel_sc = expand_voxels()
+
+        # exact min/max coords of all block volumes, cause "MinCords" and "MaxCords" are not always true
+        if len(voxel_pos) > 0:
+            min_coords = np.amin(voxel_pos, 0)
+            max_coords = np.amax(voxel_pos, 0)
+        else:
+            min_coords = max_coords = np.zeros(3, dtype=int)
+        if np.any(min_coords != self.blueprint["MinCords"]) or np.any(max_coords != self.blueprint["MaxCords"]):
+            _log.debug(f"Setting blueprint bounds from {self.blueprint["MinCords"]}, {self.blueprint["MaxCords"]} "
+                       f"to {min_coords}, {max_coords}")
+        self.blueprint["MinCords"] = min_coords
+        self.blueprint["MaxCords"] = max_coords
+        self.blueprint["Size"] = max_coords - min_coords + 1
+        voxel_pos -= min_coords
+
+        if firing_animator is not None:
+            append_shots(min_coords)
+
+        # create matrices, heights are 0 to size - 1, coverage is 1 where a block is visible
+        height_dtype = np.int16 if np.max(self.blueprint["Size"]) <= np.iinfo(np.int16).max else np.int32
+        top_color = np.full((*self.blueprint["Size"][[0, 2]], 3), np.array([255, 118, 33]), dtype=np.uint8)
+        top_height = np.zeros(self.blueprint["Size"][[0, 2]], dtype=height_dtype)
+        top_coverage = np.zeros(self.blueprint["Size"][[0, 2]], dtype=np.uint8)
+        side_color = np.full((*self.blueprint["Size"][[1, 2]], 3), np.array([255, 118, 33]), dtype=np.uint8)
+        side_height = np.zeros(self.blueprint["Size"][[1, 2]], dtype=height_dtype)
+        side_coverage = np.zeros(self.blueprint["Size"][[1, 2]], dtype=np.uint8)
+        front_color = np.full((*self.blueprint["Size"][[1, 0]], 3), np.array([255, 118, 33]), dtype=np.uint8)
+        front_height = np.zeros(self.blueprint["Size"][[1, 0]], dtype=height_dtype)
+        front_coverage = np.zeros(self.blueprint["Size"][[1, 0]], dtype=np.uint8)
+        fill_color_and_height(top_color, top_height, top_coverage, voxel_pos, voxel_color, voxel_sc, 0, 2, 1)
+        fill_color_and_height(side_color, side_height, side_coverage, voxel_pos, voxel_color, voxel_sc, 1, 2, 0)
+        fill_color_and_height(front_color, front_height, front_coverage, voxel_pos, voxel_color, voxel_sc, 1, 0, 2)
 
         # flip
         side_color = cv2.flip(side_color, 0)
         side_height = cv2.flip(side_height, 0)
+        side_coverage = cv2.flip(side_coverage, 0)
         front_color = cv2.flip(front_color, -1)
         front_height = cv2.flip(front_height, -1)
-        # _log.info(str(side_height))
+        front_coverage = cv2.flip(front_coverage, -1)
 
-        return ([top_color, top_height],  # , actual_min_coords[1]],
-                [side_color, side_height],  # , actual_min_coords[0]],
-                [front_color, front_height]  # , actual_min_coords[2]])
+        return ([top_color, top_height, top_coverage],
+                [side_color, side_height, side_coverage],
+                [front_color, front_height, front_coverage]
                 )
 
 
-def __copy_to_image(dst, start_pos, src_preblend, mask_start_pos, mask, mask_compare, mask_upscale):
+# contour edge bits, lower nibble is a height edge, upper nibble an edge to an empty cell
+contour_up, contour_down, contour_left, contour_right = 1, 2, 4, 8
+# neighbour slices (cell, neighbour) per edge bit
+contour_neighbours = [
+    (contour_up, np.s_[1:, :], np.s_[:-1, :]),
+    (contour_down, np.s_[:-1, :], np.s_[1:, :]),
+    (contour_left, np.s_[:, 1:], np.s_[:, :-1]),
+    (contour_right, np.s_[:, :-1], np.s_[:, 1:]),
+]
+
+
+def __contour_atlas(upscale_f: int) -> np.ndarray:
+    """Glyph for every contour code of a cell. Returns bool array of shape (256, upscale_f, upscale_f)."""
+    linetop = np.zeros((upscale_f, upscale_f), dtype=bool)
+    linetop[0] = True
+    linedown = np.zeros((upscale_f, upscale_f), dtype=bool)
+    linedown[-1] = True
+    lineleft = np.zeros((upscale_f, upscale_f), dtype=bool)
+    lineleft[:, 0] = True
+    lineright = np.zeros((upscale_f, upscale_f), dtype=bool)
+    lineright[:, -1] = True
+    linecircle = np.zeros((upscale_f, upscale_f), dtype=np.uint8)
+    cv2.circle(linecircle, (upscale_f//2, upscale_f//2), upscale_f//2, 1)
+    linecircle = linecircle > 0
+    # diag A is / ; diag B is \
+    linediagB = np.identity(upscale_f, dtype=bool)
+    linediagA = np.flip(linediagB, 1)
+    lines = [(contour_up, linetop), (contour_down, linedown), (contour_left, lineleft), (contour_right, lineright)]
+
+    atlas = np.zeros((256, upscale_f, upscale_f), dtype=bool)
+    for code in range(256):
+        edges = code & 15
+        empty_edges = code >> 4
+        up = bool(edges & contour_up)
+        dsum = bin(edges).count("1")
+        # circles and diagonals replace the edge lines
+        if dsum == 4:
+            atlas[code] |= linecircle
+            edges = 0
+        elif dsum == 2 and up == bool(edges & contour_left):
+            atlas[code] |= linediagA
+            edges = 0
+        elif dsum == 2 and up == bool(edges & contour_right):
+            atlas[code] |= linediagB
+            edges = 0
+        # single edge to an empty cell is always drawn
+        if bin(empty_edges).count("1") == 1:
+            edges |= empty_edges
+        for bit, line in lines:
+            if edges & bit:
+                atlas[code] |= line
+    return atlas
+
+
+def upscale_nearest(src: np.ndarray, factor: int, out: np.ndarray | None = None) -> np.ndarray:
+    """Upscale src by integer factor by repeating every pixel factor x factor times.
+    Writes into out, which can be any view (e.g. a slice of a bigger image) of shape
+    (src.shape[0]*factor, src.shape[1]*factor, ...). Returns out, allocated if not given."""
+    if out is None:
+        out = np.empty((src.shape[0]*factor, src.shape[1]*factor) + src.shape[2:], dtype=src.dtype)
+    # every strided sub view of out is a full copy of src
+    for i in range(factor):
+        for j in range(factor):
+            out[i::factor, j::factor] = src
+    return out
+
+
+def __blend_pixels(dst, indices, colors, alphas, order):
     """
-    Copies src_preblend[0] (image RGB uint8) to dst at starting_pos with alpha blending.
-    Mask as depth test: mask < mask_compare
-    
-    :param dst: Destination image RGB uint8
-    :param start_pos: [x, y]
-    :param src_preblend: [Source image * source alpha RGB uint8, 1. - alpha float16]
-    :param mask_start_pos: [x, y]
-    :param mask: Depth image
-    :param mask_compare: Depth to compare
-    :param mask_upscale: Scaling for mask
+    Alpha blends single pixels onto dst: dst = color + dst * alpha.
+    Pixels at the same position are blended in drawing order, all pixels of the same overlap depth at once.
+
+    :param dst: Destination image RGB uint8, contiguous
+    :param indices: (N, ) flat pixel indices of dst
+    :param colors: (N, 3) pre blended colors (color * alpha)
+    :param alphas: (N, ) 1 - alpha
+    :param order: (N, ) drawing order
+    :return: Sorted unique flat pixel indices of dst which were drawn to
     """
-    #if src.shape == (3, ):
-    #    src = np.array([[src]])
-    # dst slice
-    start_pos_dst = np.maximum(start_pos, 0)  # TODO: needs to be clipped to single images
-    end_pos_dst = np.minimum(dst.shape[:2], start_pos + src_preblend[0].shape[:2])
-    slicer_dst = np.index_exp[start_pos_dst[0]:end_pos_dst[0], start_pos_dst[1]:end_pos_dst[1]]
-    # mask slice
-    start_pos_mask = np.maximum(mask_start_pos, 0)
-    end_pos_mask = np.minimum(mask.shape[:2], mask_start_pos + np.array(src_preblend[0].shape[:2])//mask_upscale)
-    slicer_mask = np.index_exp[start_pos_mask[0]:end_pos_mask[0], start_pos_mask[1]:end_pos_mask[1]]
-    # src slice
-    start_pos = start_pos_dst - start_pos
-    end_pos = start_pos + end_pos_dst - start_pos_dst
-    slicer_src = np.index_exp[start_pos[0]:end_pos[0], start_pos[1]:end_pos[1]]
-    # masking
-    mask = mask[slicer_mask] < mask_compare
-    mask = mask.repeat(mask_upscale, axis=1).repeat(mask_upscale, axis=0)
-    dst[slicer_dst] = np.where(mask[:, :, np.newaxis], src_preblend[0][slicer_src] + dst[slicer_dst] * src_preblend[1], dst[slicer_dst])
-
-
-def __line_on_image(dst, start_pos, draw_start, draw_size, src_preblend, rotation, line_offset, line_width, mask_start_pos, mask, mask_compare, mask_upscale):
+    if len(indices) == 0:
+        return indices
+    flat = dst.reshape(-1, dst.shape[2])
+    sort = np.lexsort((order, indices))
+    indices = indices[sort]
+    first = np.ones(len(indices), dtype=bool)
+    first[1:] = indices[1:] != indices[:-1]
+    # number of pixels drawn before at the same position
+    positions = np.arange(len(indices))
+    depth = positions - np.maximum.accumulate(np.where(first, positions, 0))
+    by_depth = np.argsort(depth, kind="stable")
+    bounds = np.searchsorted(depth[by_depth], np.arange(depth[by_depth[-1]] + 2))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        pixels = by_depth[start:end]
+        src = sort[pixels]
+        dst_indices = indices[pixels]
+        flat[dst_indices] = colors[src] + flat[dst_indices] * alphas[src, np.newaxis]
+    return indices[first]
+
+
+def __bounding_slice(indices: np.ndarray, shape) -> tuple[slice, slice]:
+    """Smallest slice containing all flat pixel indices, top left pixel if there are none"""
+    if len(indices) == 0:
+        return np.index_exp[0:1, 0:1]
+    rows, cols = np.divmod(indices, shape[1])
+    return np.index_exp[rows.min():rows.max() + 1, cols.min():cols.max() + 1]
+
+
+def __line_slice(dst_shape, start_pos, draw_start, draw_size, rotation, line_offset, line_width, mask_upscale):
     """
-    Draws a line with color src_preblend[0] (RGB uint8) (or callable) to dst at starting_pos with alpha blending.
-    Mask as depth test: mask < mask_compare
-    
-    :param dst: Destination image RGB uint8
+    Region of a line from start_pos to the border of its view in direction of rotation.
+
+    :param dst_shape: Shape of destination image
     :param start_pos: [x, y]
     :param draw_start: [x, y] start coordinate in combined view image
     :param draw_size: [x, y] size of view
-    :param src_preblend: [Value * alpha RGB uint8, 1. - alpha float16] first value can be a function to generate color
     :param rotation: Rotation of line
-    :param mask_start_pos: [x, y]
-    :param mask: Depth image
-    :param mask_compare: Depth to compare
-    :param mask_upscale: Scaling for mask
+    :param line_offset: Offset of line perpendicular to its direction
+    :param line_width: Width of line
+    :param mask_upscale: Scaling of view
+    :return: Slice of destination image
     """
-    #if src.shape == (3, ):
-    #    src = np.array([[src]])
-    # dst slice
     if rotation == 0:
         start_pos[0] += line_offset
         start_pos_dst = start_pos + draw_start
-        end_pos_dst = [start_pos_dst[0] + line_width, dst.shape[1]]
+        end_pos_dst = [start_pos_dst[0] + line_width, dst_shape[1]]
     elif rotation == 1:
         start_pos += mask_upscale - 1
         start_pos[1] -= line_offset
@@ -783,193 +1024,150 @@ def __line_on_image(dst, start_pos, draw_start, draw_size, src_preblend, rotatio
     elif rotation == 3:
         start_pos[1] += line_offset
         start_pos_dst = start_pos + draw_start
-        end_pos_dst = [dst.shape[0], start_pos_dst[1] + line_width]
+        end_pos_dst = [dst_shape[0], start_pos_dst[1] + line_width]
     else:
         start_pos += line_offset
         start_pos_dst = start_pos + draw_start
         end_pos_dst = start_pos_dst + line_width
     start_pos_dst = np.clip(start_pos_dst, draw_start + 2, draw_start + draw_size - 1 - 2)
     end_pos_dst = np.clip(end_pos_dst, draw_start + 1 + 2, draw_start + draw_size - 2)
-    slicer_dst = np.index_exp[start_pos_dst[0]:end_pos_dst[0], start_pos_dst[1]:end_pos_dst[1]]
-    # mask slice
-    start_pos_mask = np.maximum(mask_start_pos, 0)
-    end_pos_mask = mask.shape[:2]
-    slicer_mask = np.index_exp[start_pos_mask[0]:end_pos_mask[0], start_pos_mask[1]:end_pos_mask[1]]
-    # masking
-    mask = mask[slicer_mask] < mask_compare
-    mask = mask.repeat(mask_upscale, axis=1).repeat(mask_upscale, axis=0)
-    #dst[slicer_dst] = np.where(mask[:, :, np.newaxis], src_preblend[0] + dst[slicer_dst] * src_preblend[1], dst[slicer_dst])
-    if callable(src_preblend[0]):
-        src_preblend[0] = src_preblend[0](start_pos_dst, end_pos_dst)
-    dst[slicer_dst] = src_preblend[0] + dst[slicer_dst] * src_preblend[1]
+    return np.index_exp[start_pos_dst[0]:end_pos_dst[0], start_pos_dst[1]:end_pos_dst[1]]
+
+
+@functools.lru_cache(maxsize=32)
+def get_font(size: int, axes: tuple[int, int] | None = None) -> ImageFont.FreeTypeFont:
+    """Bahnschrift font of given size and variation axes (weight, width), loaded once per process.
+    Returned font is shared, do not change its variation."""
+    font = ImageFont.truetype("bahnschrift.ttf", size)
+    if axes is not None:
+        font.set_variation_by_axes(list(axes))
+    return font
+
+
+@functools.lru_cache(maxsize=4096)
+def text_length(text: str, size: int, axes: tuple[int, int] | None = None) -> float:
+    """Memoized length of text in pixels, see get_font"""
+    return get_font(size, axes).getlength(text, "L")
+
+
+def __plan_layout(side_shape, front_shape, top_shape, info_shape, aspect_ratio: float | None = None):
+    """
+    Plans combined image: side and front view in the top row, top view and info in the bottom row.
+    Gaps are filled with background, padding is added to reach aspect_ratio (width / height).
+
+    :param side_shape: [rows, columns] of side image, same for front_shape, top_shape and info_shape
+    :param aspect_ratio: Wanted aspect ratio or None
+    :return: Shape of combined image, [row, column] of side, front, top and info image,
+             [row, column] where the bottom row and right column start
+    """
+    pixels_top = pixels_bottom = pixels_left = pixels_right = 0
+    if aspect_ratio is not None:
+        res_img_shape = [side_shape[0] + info_shape[0], side_shape[1] + info_shape[1]]
+        if res_img_shape[1] / res_img_shape[0] > aspect_ratio:
+            # too wide, pad height
+            needed_pixels = int(res_img_shape[1] / aspect_ratio) - res_img_shape[0]
+            pixels_top = needed_pixels // 2
+            pixels_bottom = needed_pixels - pixels_top
+        else:
+            # too high, pad width
+            needed_pixels = int(res_img_shape[0] * aspect_ratio) - res_img_shape[1]
+            pixels_left = needed_pixels // 2
+            pixels_right = needed_pixels - pixels_left
+    split = [pixels_top + side_shape[0], pixels_left + side_shape[1]]
+    res_shape = (split[0] + max(top_shape[0], info_shape[0]) + pixels_bottom,
+                 split[1] + max(front_shape[1], info_shape[1]) + pixels_right,
+                 3)
+    positions = [[pixels_top, pixels_left], [pixels_top, split[1]], [split[0], pixels_left], split]
+    return res_shape, positions, split
 
 
 def __create_images(top_mat, side_mat, front_mat, bp_infos, contours=True, upscale_f=5,
-                    gif_args:FiringAnimator|None=None, firing_order=2, file_name="unknown", aspect_ratio=None):
-    """Create images from view matrices"""
-    def create_image(mat, upscale_f, axis):
-        """Create single image. Contents of mat will be changed."""
+                    gif_args:FiringAnimator|None=None, firing_order=2, gif_file: str | io.BytesIO = "unknown.gif",
+                    aspect_ratio=None):
+    """Create images from view matrices. Returns the combined image,
+    or None if gif_args is given, then the gif is encoded to gif_file (file name or in memory buffer)"""
+    def create_image(mat, upscale_f, axis, dst=None):
+        """Create single image. Contents of mat will be changed.
+        The upscaled image is written into dst (allocated if None) and stored in mat[0]."""
         # border
-        if gif_args is None:
-            mat[0] = cv2.copyMakeBorder(mat[0], 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=(255, 118, 33))
-            mat[1] = cv2.copyMakeBorder(mat[1], 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=-12345)
-        else:
-            mat[0] = cv2.copyMakeBorder(mat[0], gif_border, gif_border, gif_border, gif_border, cv2.BORDER_CONSTANT,
-                                        value=(255, 118, 33))
-            mat[1] = cv2.copyMakeBorder(mat[1], gif_border, gif_border, gif_border, gif_border, cv2.BORDER_CONSTANT,
-                                        value=-12345)
+        mat[0] = cv2.copyMakeBorder(mat[0], border, border, border, border, cv2.BORDER_CONSTANT, value=(255, 118, 33))
+        mat[1] = cv2.copyMakeBorder(mat[1], border, border, border, border, cv2.BORDER_CONSTANT, value=0)
+        mat[2] = cv2.copyMakeBorder(mat[2], border, border, border, border, cv2.BORDER_CONSTANT, value=0)
         height = mat[1]
+        covered = mat[2] > 0
         # height coloring
-        hmax = np.max(height)
-        hmap = height
-        hmap = np.where(hmap == -12345, hmax, hmap)
-        hmin = np.min(hmap)  # mat[2]
+        if np.any(covered):
+            hmax = int(np.max(height[covered]))
+            hmin = int(np.min(height[covered]))
+        else:
+            hmax = hmin = 0
         if hmin == hmax:
             hmin -= 1
         dh = hmax - hmin
         dhN = dh + dh + dh + dh
-        hmap = (hmap + (dhN - hmin))/(dh + dhN)
-        mat[0] = np.multiply(mat[0], hmap[:, :, np.newaxis])
-        # clip and convert to uint8
-        mat[0] = np.clip(mat[0], 0, 255).astype(np.uint8)
-        # height = height.astype
+        # shading factor hmap / (dh + dhN) as exact integer fraction, 1 where empty
+        hmap = height.astype(np.int32)
+        hmap[~covered] = hmax
+        hmap += dhN - hmin
+        # factor is at most 1, so no clipping needed, floor division truncates like a uint8 cast
+        for channel in range(3):
+            mat[0][:, :, channel] = mat[0][:, :, channel] * hmap // (dh + dhN)
+        hmap = None
         # resize
-        mat[0] = cv2.resize(mat[0], (mat[0].shape[1]*upscale_f, mat[0].shape[0]*upscale_f),
-                            interpolation=cv2.INTER_AREA)
+        mat[0] = upscale_nearest(mat[0], upscale_f, dst)
 
         if contours:
-            # contours
-            # rolling
-            roll_up = np.roll(height, 1, 0)  # rolled down for up difference calculation
-            roll_down = np.roll(height, -1, 0)
-            roll_left = np.roll(height, 1, 1)
-            roll_right = np.roll(height, -1, 1)
-
-            # difference
-            dup = np.where(height - roll_up > 1, 1, 0).astype(np.int8)  # dtype of where is int32
-            ddown = np.where(height - roll_down > 1, 1, 0).astype(np.int8)
-            dleft = np.where(height - roll_left > 1, 1, 0).astype(np.int8)
-            dright = np.where(height - roll_right > 1, 1, 0).astype(np.int8)
-
-            # not used as roll_... is required later
-            #cv2 filter2D
-            #sci_dup = convolve2d(height, np.array([[0],[1],[-1]]), mode="same", fillvalue=-1)
-            #sci_ddown = convolve2d(height, np.array([[-1],[1],[0]]), mode="same", fillvalue=-1)
-            #sci_dleft = convolve2d(height, np.array([[0,1,-1]]), mode="same", fillvalue=-1)
-            #sci_dright = convolve2d(height, np.array([[-1,1,0]]), mode="same", fillvalue=-1)
-
-            # "super" difference
-            superable = height > -12345
-            superup = np.where((roll_up == -12345) & superable, 1, 0).astype(np.int8)  # dtype is bool ???
-            superdown = np.where((roll_down == -12345) & superable, 1, 0).astype(np.int8)
-            superleft = np.where((roll_left == -12345) & superable, 1, 0).astype(np.int8)
-            superright = np.where((roll_right == -12345) & superable, 1, 0).astype(np.int8)
-            boolsupersum1 = (superup + superdown + superleft + superright) == 1
-            superup = (superup == 1) & boolsupersum1
-            superdown = (superdown == 1) & boolsupersum1
-            superleft = (superleft == 1) & boolsupersum1
-            superright = (superright == 1) & boolsupersum1
-
-            # sum, circle, edges
-            dsum = dup + ddown + dleft + dright
-            booldcircle = dsum == 4
-            dcircle = np.where(booldcircle, 1, 0).astype(np.int8)
-
-            # remove circles
-            dup[booldcircle] = 0
-            ddown[booldcircle] = 0
-            dleft[booldcircle] = 0
-            dright[booldcircle] = 0
-
-            # diag A is / ; diag B is \
-            booldsum2 = dsum == 2
-            boolddiagA = booldsum2 & (dup == dleft)
-            boolddiagB = booldsum2 & (dup == dright)
-            ddiagA = np.where(boolddiagA, 1, 0).astype(np.int8)  # dtype of where is int32
-            ddiagB = np.where(boolddiagB, 1, 0).astype(np.int8)
-
-            # remove diags
-            dup[boolddiagA] = 0
-            ddown[boolddiagA] = 0
-            dleft[boolddiagA] = 0
-            dright[boolddiagA] = 0
-            dup[boolddiagB] = 0
-            ddown[boolddiagB] = 0
-            dleft[boolddiagB] = 0
-            dright[boolddiagB] = 0
-
-            # re-add super
-            dup[superup] = 1
-            ddown[superdown] = 1
-            dleft[superleft] = 1
-            dright[superright] = 1
-
-            # kronecker upscale
-            dupimg = np.kron(dup, linetop)
-            dup = None  # does
-            ddownimg = np.kron(ddown, linedown)
-            ddown = None  # this
-            dleftimg = np.kron(dleft, lineleft)
-            dleft = None  # help
-            drightimg = np.kron(dright, lineright)
-            dright = None  # with
-            dcircleimg = np.kron(dcircle, linecircle)
-            dcircle = None  # memory
-            ddiagAimg = np.kron(ddiagA, linediagA)
-            ddiagA = None  # consumption
-            ddiagBimg = np.kron(ddiagB, linediagB)
-            ddiagB = None  # ?
-            dimg = dupimg + ddownimg + dleftimg + drightimg + dcircleimg + ddiagAimg + ddiagBimg
-
-            mat[0][dimg > 0] = 255
+            # contour code per cell, empty neighbours count as infinitely low
+            # border cells are never covered, so their missing neighbours don't matter
+            code = np.zeros(height.shape, dtype=np.uint8)
+            for bit, cell, neighbour in contour_neighbours:
+                cell_covered = covered[cell]
+                empty = cell_covered & ~covered[neighbour]
+                code_view = code[cell]
+                code_view[empty | (cell_covered & (height[cell] - height[neighbour] > 1))] |= bit
+                code_view[empty] |= bit << 4
+            # stamp glyphs of cells with contours into the upscaled image
+            rows, cols = np.nonzero(contour_atlas_used[code])
+            cell, glyph_row, glyph_col = np.nonzero(contour_atlas[code[rows, cols]])
+            mat[0][rows[cell]*upscale_f + glyph_row, cols[cell]*upscale_f + glyph_col] = 255
 
 
     # upscale_f = 5
     gif_border = 10
-    # lines
-    linetop = np.zeros((upscale_f, upscale_f), dtype=np.int8)
-    linetop[0] = 1
-    linedown = np.zeros((upscale_f, upscale_f), dtype=np.int8)
-    linedown[-1] = 1
-    lineleft = np.zeros((upscale_f, upscale_f), dtype=np.int8)
-    lineleft[:, 0] = 1
-    lineright = np.zeros((upscale_f, upscale_f), dtype=np.int8)
-    lineright[:, -1] = 1
-    linecircle = np.zeros((upscale_f, upscale_f), dtype=np.int8)
-    cv2.circle(linecircle, (upscale_f//2, upscale_f//2), upscale_f//2, 1)
-    linediagB = np.identity(upscale_f, dtype=np.int8)
-    linediagA = np.flip(linediagB, 1)
+    gif_palette_sample_frames = 4  # frames drawn before the animation to collect palette colors
+    # contour glyphs
+    contour_atlas = __contour_atlas(upscale_f)
+    contour_atlas_used = contour_atlas.any(axis=(1, 2))
     # create images
     height_map = [None, None, None]
+    coverage_map = [None, None, None]
     #top_img_old_shape = top_mat[0].shape
     side_img_old_shape = side_mat[0].shape
     front_img_old_shape = front_mat[0].shape
-    create_image(top_mat, upscale_f, 1)
-    top_img, height_map[1] = top_mat
-    create_image(side_mat, upscale_f, 0)
-    side_img, height_map[0] = side_mat
-    create_image(front_mat, upscale_f, 2)
-    front_img, height_map[2] = front_mat
+    # shapes of upscaled images with border
+    border = 1 if gif_args is None else gif_border
+    side_img_shape = (np.array(side_mat[0].shape[:2]) + 2 * border) * upscale_f
+    front_img_shape = (np.array(front_mat[0].shape[:2]) + 2 * border) * upscale_f
+    top_img_shape = (np.array(top_mat[0].shape[:2]) + 2 * border) * upscale_f
 
     def fill_info_img():
-        # load font for length measurement
+        # font for length measurement
         bahnschrift_scale = 30
-        bahnschrift = ImageFont.truetype("bahnschrift.ttf", bahnschrift_scale)
-        bahnschrift.set_variation_by_axes([300, 85])
+        light = (300, 85)
+        bold = (500, 85)
         min_text_scale = 20
         # find max size text
         if bp_infos is None:
             padding_factor = 2.
-            width = front_img.shape[1]
-            text_length_check = bahnschrift.getlength("Error", "L")
+            width = front_img_shape[1]
+            text_length_check = text_length("Error", bahnschrift_scale, light)
             text_length_with_padding = padding_factor * text_length_check
             text_scale = int(width / text_length_with_padding * bahnschrift_scale)
             if text_scale < min_text_scale:
                 # drop the padding
                 padding_factor = 1.
                 text_scale = max(min_text_scale, int(width / text_length_check * bahnschrift_scale))
-            font = ImageFont.truetype("bahnschrift.ttf", text_scale)
-            font.set_variation_by_axes([300, 85])
+            font = get_font(text_scale, light)
             width = max(width, int(text_scale / bahnschrift_scale * text_length_check))  # int(font.getlength("Error") * padding_factor))
 
             info_img = Image.new("RGB", (width, width), (255, 118, 33))
@@ -982,14 +1180,13 @@ def __create_images(top_mat, side_mat, front_mat, bp_infos, contours=True, upsca
             max_length = 0
             for k in bp_infos:
                 text = f"{k}: {bp_infos[k]}"
-                text_length = bahnschrift.getlength(text, "L")
-                max_length = max(max_length, text_length)
+                max_length = max(max_length, text_length(text, bahnschrift_scale, light))
 
-            metric = bahnschrift.getmetrics()
+            metric = get_font(bahnschrift_scale, light).getmetrics()
             length_padded = max_length + (metric[0] + metric[1])  # don't forget to change padding below
 
             # minimum size
-            width = front_img.shape[1]
+            width = front_img_shape[1]
             height = width
 
             # find text scale
@@ -999,8 +1196,7 @@ def __create_images(top_mat, side_mat, front_mat, bp_infos, contours=True, upsca
                 width = int(text_scale / bahnschrift_scale * length_padded)
 
             # load font
-            font = ImageFont.truetype("bahnschrift.ttf", text_scale)
-            # font.set_variation_by_axes([300, 85])
+            font = get_font(text_scale)
             metric = font.getmetrics()
             text_height = metric[0] + metric[1]
             padding = int(text_height * 0.5)  # don't forget to change padding above
@@ -1015,12 +1211,10 @@ def __create_images(top_mat, side_mat, front_mat, bp_infos, contours=True, upsca
             info_draw = ImageDraw.Draw(info_img)
             y_loc = line_space
             for k in bp_infos:
-                font.set_variation_by_axes([500, 85])
                 text = f"{k}: "
-                info_draw.text((padding, y_loc), text, fill=(255, 255, 255), font=font)
-                font.set_variation_by_axes([300, 85])
-                info_draw.text((padding + info_draw.textlength(text, font), y_loc), bp_infos[k],
-                                fill=(255, 255, 255), font=font)
+                info_draw.text((padding, y_loc), text, fill=(255, 255, 255), font=get_font(text_scale, bold))
+                info_draw.text((padding + text_length(text, text_scale, bold), y_loc), bp_infos[k],
+                                fill=(255, 255, 255), font=get_font(text_scale, light))
                 y_loc += line_space + text_height
             info_img = np.array(info_img, dtype=np.uint8)
 
@@ -1031,184 +1225,168 @@ def __create_images(top_mat, side_mat, front_mat, bp_infos, contours=True, upsca
     darkBlue = np.array([255, 100, 0])
     lightBlue = np.array([255, 118, 33])
 
-    # save shape of images for later use, so images can be freed
-    side_img_shape = np.array(side_img.shape)
-    front_img_shape = np.array(front_img.shape)
-    top_img_shape = np.array(top_img.shape)
-    # aspect ratio
-    if type(aspect_ratio) == float and gif_args is None:
-        res_img_shape = [side_img_shape[0] + info_img.shape[0], side_img_shape[1] + info_img.shape[1]]
-        #_log.debug("Calc res img size: %s", res_img_shape)
-        #_log.debug(f"Aspect ratio: {res_img_shape[1] / res_img_shape[0]} wanted: {aspect_ratio}")
-        if res_img_shape[1] / res_img_shape[0] > aspect_ratio:
-            # too wide, pad height
-            needed_pixels = int(res_img_shape[1] / aspect_ratio) - res_img_shape[0]
-            pixels_top = needed_pixels // 2
-            pixels_bottom = needed_pixels - pixels_top
-            # top row pixels
-            side_img = np.concatenate((np.full((pixels_top, side_img.shape[1], 3), lightBlue, dtype=np.uint8),
-                                        side_img), 0)
-            side_img_shape[0] += pixels_top
-            front_img = np.concatenate((np.full((pixels_top, front_img.shape[1], 3), lightBlue, dtype=np.uint8),
-                                        front_img), 0)
-            front_img_shape[0] += pixels_top
-            # bottom row pixels
-            top_img = np.concatenate((top_img, 
-                                        np.full((pixels_bottom, top_img.shape[1], 3), lightBlue, dtype=np.uint8)), 0)
-            top_img_shape[0] += pixels_bottom
-            info_img = np.concatenate((info_img,
-                                        np.full((pixels_bottom, info_img.shape[1], 3), lightBlue, dtype=np.uint8)), 0)
-        else:
-            # too high, pad width
-            needed_pixels = int(res_img_shape[0] * aspect_ratio) - res_img_shape[1]
-            pixels_left = needed_pixels // 2
-            pixels_right = needed_pixels - pixels_left
-            # left side pixels
-            side_img = np.concatenate((np.full((side_img.shape[0], pixels_left, 3), lightBlue, dtype=np.uint8),
-                                        side_img), 1)
-            side_img_shape[1] += pixels_left
-            top_img = np.concatenate((np.full((top_img.shape[0], pixels_left, 3), lightBlue, dtype=np.uint8),
-                                        top_img), 1)
-            top_img_shape[1] += pixels_left
-            # right side pixels
-            front_img = np.concatenate((front_img,
-                                        np.full((front_img.shape[0], pixels_right, 3), lightBlue, dtype=np.uint8)), 1)
-            front_img_shape[0] += pixels_right
-            info_img = np.concatenate((info_img,
-                                        np.full((info_img.shape[0], pixels_right, 3), lightBlue, dtype=np.uint8)), 1)
-    # combine images
-    bottombuffer = np.full((max(0, info_img.shape[0]-top_img.shape[0]), top_img.shape[1], 3),
-                            lightBlue, dtype=np.uint8)
-    rightbuffer = np.full((front_img.shape[0], max(0, info_img.shape[1]-front_img.shape[1]), 3),
-                            lightBlue, dtype=np.uint8)
-    # update stored shapes
-    front_img_shape[1] += rightbuffer.shape[1]
-    front_img_shape[0] += bottombuffer.shape[0] #  TODO: shouldn't this be top_img_shape[0]
-    # border side to front
-    side_img[:, -2:] = darkBlue
-    front_img[:, :2] = darkBlue
-    toprow = np.concatenate((side_img, front_img, rightbuffer), 1)
-    bottomrow = np.concatenate((top_img, bottombuffer), 0)
-    # border top to info
-    bottomrow[:, -2:] = darkBlue
-    info_img[:, :2] = darkBlue
-    bottomrow = np.concatenate((bottomrow, info_img), 1)
-    # border toprow to bottomrow
-    toprow[-2:, :] = darkBlue
-    bottomrow[:2, :] = darkBlue
-    res = np.concatenate((toprow, bottomrow), 0)
+    # plan combined image, all images are drawn directly into it
+    if type(aspect_ratio) != float or gif_args is not None:
+        aspect_ratio = None
+    res_shape, positions, split = __plan_layout(side_img_shape, front_img_shape, top_img_shape, info_img.shape[:2],
+                                                aspect_ratio)
+    res = np.full(res_shape, lightBlue, dtype=np.uint8)
+    for axis, mat, img_shape, (row, col) in zip((0, 2, 1), (side_mat, front_mat, top_mat),
+                                               (side_img_shape, front_img_shape, top_img_shape), positions):
+        create_image(mat, upscale_f, axis, res[row:row+img_shape[0], col:col+img_shape[1]])
+        _, height_map[axis], coverage_map[axis] = mat
+    row, col = positions[3]
+    res[row:row+info_img.shape[0], col:col+info_img.shape[1]] = info_img
+    # borders between images
+    res[:, split[1]-2:split[1]+2] = darkBlue
+    res[split[0]-2:split[0]+2, :] = darkBlue
+
+    # update stored shapes with buffers, only used by gif which has no aspect ratio padding
+    front_img_shape[1] = res_shape[1] - split[1]
+    front_img_shape[0] += max(0, info_img.shape[0] - top_img_shape[0]) #  TODO: shouldn't this be top_img_shape[0]
+    info_img = None
 
     # gif animation
     # TODO: optimize
     if gif_args:
         gif_args.setup_order(axis=firing_order)
-        file_name += ".gif"
-        duration_list = [2500] + [10]*gif_args.get_total_frame_count()  # in ms
-        with imageio.get_writer(file_name, format="gif", mode="i", loop=0,
-                                duration=duration_list,
-                                #disposal=[2]*len(duration_list),  # reset changed image to prev (?)
-                                subrectangles=True,  # most likely obsolete
-                                #transparency=False,  # bad artifacts
-                                optimize=True
-                                ) as writer:
-            writer.append_data(cv2.cvtColor(res, cv2.COLOR_BGR2RGB))
-            for i in gif_args.iter_frames():
-                frame = np.array(res)
-                for axis in range(3):
-                    # TODO: these are constant values, create them somewhere else
-                    if axis == 0:
-                        # side view
-                        axis_flip_add = np.array([side_img_old_shape[0] - 1, 0], dtype=int)
-                        axis_flip_mul = np.array([-1, 1], dtype=int)
-                        axisA = 1
-                        axisB = 2
-                        offset = np.zeros(2, dtype=int)
-                        size = side_img_shape[:2]# - 2
-                    elif axis == 2:
-                        # front view
-                        axis_flip_add = np.array([front_img_old_shape[0] - 1, front_img_old_shape[1] - 1], dtype=int)
-                        axis_flip_mul = np.array([-1, -1], dtype=int)
-                        axisA = 1
-                        axisB = 0
-                        offset = np.array([0, side_img_shape[1]], dtype=int)
-                        size = front_img_shape[:2]# - np.array([2, 0])
+        frame = np.array(res)
+
+        def draw_frame():
+            """Draws current animation frame of all views to frame. Returns flat indices of pixels which were drawn to"""
+            drawn = []
+            for axis in range(3):
+                # TODO: these are constant values, create them somewhere else
+                if axis == 0:
+                    # side view
+                    axis_flip_add = np.array([side_img_old_shape[0] - 1, 0], dtype=int)
+                    axis_flip_mul = np.array([-1, 1], dtype=int)
+                    axisA = 1
+                    axisB = 2
+                    offset = np.zeros(2, dtype=int)
+                    size = side_img_shape[:2]# - 2
+                elif axis == 2:
+                    # front view
+                    axis_flip_add = np.array([front_img_old_shape[0] - 1, front_img_old_shape[1] - 1], dtype=int)
+                    axis_flip_mul = np.array([-1, -1], dtype=int)
+                    axisA = 1
+                    axisB = 0
+                    offset = np.array([0, side_img_shape[1]], dtype=int)
+                    size = front_img_shape[:2]# - np.array([2, 0])
+                else:
+                    # top view
+                    axis_flip_add = np.zeros(2, dtype=int)
+                    axis_flip_mul = np.ones(2, dtype=int)
+                    axisA = 0
+                    axisB = 2
+                    offset = np.array([side_img_shape[0], 0], dtype=int)
+                    size = top_img_shape[:2]# - np.array([0, 2])
+                mask, coverage = height_map[axis], coverage_map[axis]
+                positions, directions, firing_types, states = gif_args.get_ordered(axis)
+                visible = (states >= 0) & (states < firing_animator.sprite_frame_count)
+                # rotation id of each shot, see firing_animator
+                rotations = np.select([directions[:, axisA] == 1, directions[:, axisA] == -1,
+                                       directions[:, axisB] == 1, directions[:, axisB] == -1,
+                                       directions[:, axis] == 1, directions[:, axis] == -1],
+                                      [3 if axis == 1 else 1, 1 if axis == 1 else 3,
+                                       2 if axis == 2 else 0, 0 if axis == 2 else 2, 4, 5], 0)
+                transformed_pos = positions[:, [axisA, axisB]] * axis_flip_mul + axis_flip_add + gif_border
+                # all pixels of this view are collected with their drawing order and blended together
+                pixel_indices, pixel_colors, pixel_alphas, pixel_order = [], [], [], []
+
+                # normal shots, one sprite per shot
+                shots = np.nonzero(visible & (firing_types == 1))[0]
+                sprite_ids = rotations[shots] * firing_animator.sprite_frame_count + states[shots]
+                mask_pos = transformed_pos[shots] - firing_animator.sprite_offsets[rotations[shots]] // upscale_f
+                start_pos = mask_pos * upscale_f + offset
+                depth = positions[shots, axis] + firing_animator.sprite_depths[rotations[shots], states[shots]]
+                counts = firing_animator.sprite_pixel_starts[sprite_ids + 1] - firing_animator.sprite_pixel_starts[sprite_ids]
+                shot = np.repeat(np.arange(len(shots)), counts)
+                pixel = np.arange(len(shot)) + np.repeat(firing_animator.sprite_pixel_starts[sprite_ids]
+                                                         - np.cumsum(counts) + counts, counts)
+                rows = firing_animator.sprite_pixel_rows[pixel]
+                cols = firing_animator.sprite_pixel_cols[pixel]
+                mask_rows = mask_pos[shot, 0] + rows // upscale_f
+                mask_cols = mask_pos[shot, 1] + cols // upscale_f
+                rows += start_pos[shot, 0]
+                cols += start_pos[shot, 1]
+                # clip to view and frame, then depth test: mask < depth or not covered
+                keep = (mask_rows >= 0) & (mask_rows < mask.shape[0]) & (mask_cols >= 0) & (mask_cols < mask.shape[1]) \
+                    & (rows >= 0) & (rows < frame.shape[0]) & (cols >= 0) & (cols < frame.shape[1])
+                keep[keep] = (mask[mask_rows[keep], mask_cols[keep]] < depth[shot[keep]]) \
+                    | (coverage[mask_rows[keep], mask_cols[keep]] == 0)
+                pixel_indices.append(rows[keep] * frame.shape[1] + cols[keep])
+                pixel_colors.append(firing_animator.sprite_pixel_colors[pixel[keep]])
+                pixel_alphas.append(firing_animator.sprite_pixel_alphas[pixel[keep]])
+                pixel_order.append(shots[shot[keep]])
+
+                # lines, no depth test
+                for i in np.nonzero(visible & np.isin(firing_types, (2, 3, 4)))[0]:
+                    if firing_types[i] == 2:
+                        # red laser
+                        # laser color bgr = [0, 19, 255]
+                        line_offset, line_width, color, alpha = 1, 3, np.array([0, 11, 153]), 0.4
+                    elif firing_types[i] == 3:
+                        # blue particle beam
+                        # beam color bgr = [201, 121, 80]
+                        line_offset, line_width, color, alpha = 1, 3, np.array([229, 229, 229]), 0.1
                     else:
-                        # top view
-                        axis_flip_add = np.zeros(2, dtype=int)
-                        axis_flip_mul = np.ones(2, dtype=int)
-                        axisA = 0
-                        axisB = 2
-                        offset = np.array([side_img_shape[0], 0], dtype=int)
-                        size = top_img_shape[:2]# - np.array([0, 2])
-
-                    for position, direction, strength in gif_args.iter_ordered(axis):
-                        rotation = 0
-                        if direction[axisA] == 1:
-                            rotation = 3 if axis == 1 else 1
-                        elif direction[axisA] == -1:
-                            rotation = 1 if axis == 1 else 3
-                        elif direction[axisB] == 1:
-                            rotation = 2 if axis == 2 else 0
-                        elif direction[axisB] == -1:
-                            rotation = 0 if axis == 2 else 2
-                        elif direction[axis] == 1:
-                            rotation = 4
-                        elif direction[axis] == -1:
-                            rotation = 5
-
-                        firing_type = gif_args.get_animation_type()
-                        if firing_type == 1:
-                            # normal shot
-                            anim = gif_args.get_animation(rotation_id=rotation)
-                            if anim is not None:
-                                anim_image, anim_depth, anim_offset = anim
-                                transformed_pos = position[[axisA, axisB]] * axis_flip_mul + axis_flip_add + gif_border
-                                transformed_pos = transformed_pos - anim_offset // upscale_f
-                                __copy_to_image(frame, transformed_pos * upscale_f + offset, anim_image,
-                                                transformed_pos, height_map[axis], position[axis] + anim_depth,
-                                                upscale_f)
-                        else:
-                            if gif_args.get_animation_state() is not None:
-                                transformed_pos = position[[axisA, axisB]] * axis_flip_mul + axis_flip_add + gif_border
-                                
-                                if firing_type == 2:
-                                    # red laser
-                                    # laser color bgr = [0, 19, 255]
-                                    __line_on_image(frame, transformed_pos * upscale_f, offset, size,
-                                                    [np.array([0, 11, 153], dtype=np.uint8), 0.4],
-                                                    rotation, 1, 3, transformed_pos, height_map[axis], position[axis],
-                                                    upscale_f)
-                                elif firing_type == 3:
-                                    # blue particle beam
-                                    # beam color bgr = [201, 121, 80]
-                                    __line_on_image(frame, transformed_pos * upscale_f, offset, size,
-                                                    [np.array([229, 229, 229], dtype=np.uint8), 0.1],
-                                                    rotation, 1, 3, transformed_pos, height_map[axis], position[axis],
-                                                    upscale_f)
-                                elif firing_type == 4:
-                                    # flamer beam
-                                    def generate_flame_line_color(start, end):
-                                        # flame color bgr = from [0, 240, 255] to [0, 20, 255] alpha 0.6
-                                        mat = np.full((end[0] - start[0], end[1] - start[1], 3), np.array([0, 20, 255]), dtype=np.uint8)
-                                        mix_mat = np.random.rand(end[0] - start[0], end[1] - start[1])
-                                        kernel = np.array([[.05,.13,.05],[.13,.28,.13],[.05,.13,.05]])
-                                        mix_mat = convolve2d(mix_mat, kernel / np.sum(kernel), "same", "symm")
-                                        mat = mat + mix_mat[:,:, np.newaxis] * np.array([0, 220, 0])
-                                        return mat
-                                    
-                                    __line_on_image(frame, transformed_pos * upscale_f, offset, size,
-                                                    [generate_flame_line_color, 0.],
-                                                    rotation, -upscale_f//2, 2*upscale_f+1, transformed_pos, height_map[axis], position[axis],
-                                                    upscale_f)
-                writer.append_data(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        #optimize(file_name)  # since update: takes long and bloats file size, do not use
-        # no need to return image, as gif is stored on disk
+                        # flamer beam
+                        line_offset, line_width, color, alpha = -upscale_f // 2, 2 * upscale_f + 1, None, 0.
+                    rows, cols = np.mgrid[__line_slice(frame.shape, transformed_pos[i] * upscale_f, offset, size,
+                                                       rotations[i], line_offset, line_width, upscale_f)]
+                    if color is None:
+                        # flame color bgr = from [0, 240, 255] to [0, 20, 255] alpha 0.6
+                        mix = gif_args.get_flame_mix(rows.shape)
+                        color = np.array([0, 20, 255]) + mix[:, :, np.newaxis] * np.array([0, 220, 0])
+                    pixel_indices.append((rows * frame.shape[1] + cols).ravel())
+                    pixel_colors.append(np.broadcast_to(color, rows.shape + (3,)).reshape(-1, 3))
+                    pixel_alphas.append(np.full(rows.size, alpha))
+                    pixel_order.append(np.full(rows.size, i))
+
+                drawn.append(__blend_pixels(frame, np.concatenate(pixel_indices),
+                                            np.concatenate(pixel_colors, dtype=np.float32),
+                                            np.concatenate(pixel_alphas, dtype=np.float32), np.concatenate(pixel_order)))
+            return np.concatenate(drawn)
+
+        # palette of base image and animation colors: shots on background, laser, particle beam, flame gradient
+        # and colors drawn in sampled frames, weighted by their pixel count
+        colors = [gif_args.get_colors(lightBlue),
+                  (np.array([[0, 11, 153], [229, 229, 229]]) + lightBlue * np.array([[.4], [.1]])).astype(np.uint8),
+                  np.stack((np.zeros(221), np.arange(20, 241), np.full(221, 255)), axis=1).astype(np.uint8)]
+        frame_pixels = frame.reshape(-1, 3)
+        res_pixels = res.reshape(-1, 3)
+        for i in gif_args.iter_sample_frames(gif_palette_sample_frames):
+            drawn = draw_frame()
+            changed = np.any(frame_pixels[drawn] != res_pixels[drawn], axis=1)
+            colors.append(frame_pixels[drawn[changed]])
+            frame_pixels[drawn] = res_pixels[drawn]
+        palette = GifPalette(res, np.concatenate(colors))
+        frame_indices = np.array(palette.base_indices)
+        base_index_pixels = palette.base_indices.reshape(-1)
+        frame_index_pixels = frame_indices.reshape(-1)
+        with GifWriter(gif_file, res.shape[:2], palette) as writer:
+            writer.write(palette.base_indices, duration=2500)
+            dirty = np.zeros(0, dtype=int)  # flat indices of pixels drawn to in the last frame
+            for i in gif_args.iter_frames():
+                # restore drawn pixels from the base image instead of copying the whole image
+                frame_pixels[dirty] = res_pixels[dirty]
+                frame_index_pixels[dirty] = base_index_pixels[dirty]
+                shown = dirty
+                dirty = draw_frame()
+                # map changed pixels to palette
+                changed = dirty[np.any(frame_pixels[dirty] != res_pixels[dirty], axis=1)]
+                frame_index_pixels[changed] = palette.map(frame_pixels[changed])
+                # only write region which changed since last frame
+                slicer = __bounding_slice(np.concatenate((shown, dirty)), frame.shape[:2])
+                writer.write(frame_indices[slicer], (slicer[0].start, slicer[1].start), duration=10)
+        # gif is already encoded to gif_file (file name or in memory buffer)
         return None
 
     return res
 
 
-async def speed_test(fname):
+def speed_test(fname):
     """Just some speed testing"""
     global main_img, blueprint, bp
     testlen = 100
@@ -1218,7 +1396,7 @@ async def speed_test(fname):
     t4 = np.zeros(testlen)
     t5 = np.zeros(testlen)
     for i in range(testlen):
-        bp, timing, main_img = await process_blueprint(fname, True, True)
+        bp, timing, main_img = process_blueprint(fname, True, True)
         t1[i] = timing[0]
         t2[i] = timing[1]
         t3[i] = timing[2]
@@ -1242,10 +1420,8 @@ if __name__ == "__main__":
 
     main_img = np.zeros(0)
 
-    import asyncio
-
     if False:
-        asyncio.run(speed_test(fname))
+        speed_test(fname)
     else:
         import sys, os
         if len(sys.argv) > 1:
@@ -1255,10 +1431,7 @@ if __name__ == "__main__":
         else:
             logging.basicConfig(level="DEBUG")
 
-        async def async_main():
-            global bp, timing, main_img
-            bp, timing, main_img = await process_blueprint(fname, False, True, True, False, 2)
-        asyncio.run(async_main())
+        bp, timing, main_img = process_blueprint(fname, False, True, True, False, 2)
         if main_img is None:
             exit()
         cv2.namedWindow("Blueprint", cv2.WINDOW_NORMAL)
@@ -2,67 +2,121 @@ import numpy as np
 import cv2
 
 
+def __load_sprite(fname: str) -> list[np.ndarray]:
+    """Loads animation image with alpha channel. Returns pre blended [color * alpha uint8, 1 - alpha float16]"""
+    img = cv2.imread("firing_animation/" + fname, cv2.IMREAD_UNCHANGED)
+    alpha = img[:, :, 3:].astype(np.float16) / 255.
+    return [(img[:, :, :3] * alpha).astype(np.uint8), 1. - alpha]
+
+
+def __load_sprite_atlas():
+    """Loads all animation images and creates their rotations.
+    Returns sprites, depths and offsets to their origin, indexed by rotation id and animation state.
+    Rotation id: 0 = right, 1 = up, 2 = left, 3 = down, 4 = forwards, 5 = backwards"""
+    # side animation, rotation 0 (right)
+    side = [__load_sprite(f"frame{i}.png") for i in range(6)]
+    side_depth = [0, 1, 2, 2, 3, 3]
+    a, b = 15, 0  # origin
+    c, d = side[0][0].shape[0:2]
+    # front animation
+    front = [__load_sprite(f"frame_front{i}.png") for i in range(6)]
+    front_depth = [1, 4, 6, 6, 7, 7]
+    front_origin = [15, 15]
+    # back animation, shares the later images of the front animation
+    back = [front[0], __load_sprite("frame_back1.png"), __load_sprite("frame_back2.png")] + front[3:]
+    back_depth = [0] * 6
+    atlas = [
+        side,
+        [[np.flipud(np.transpose(arr, (1, 0, 2))) for arr in img] for img in side],
+        [[np.fliplr(arr) for arr in img] for img in side],
+        [[np.fliplr(np.transpose(arr, (1, 0, 2))) for arr in img] for img in side],
+        front,
+        back,
+    ]
+    atlas = [[[np.ascontiguousarray(arr) for arr in img] for img in rotation] for rotation in atlas]
+    depths = np.array([side_depth] * 4 + [front_depth, back_depth])
+    offsets = np.array([[a, b],
+                        [d - 5, c - a - 5],
+                        [c - a - 5, d - 5],
+                        [-b, c - a - 5],
+                        front_origin,
+                        front_origin])
+    return atlas, depths, offsets
+
+
+def __flatten_sprites(atlas):
+    """Visible pixels of all sprites, indexed by sprite id = rotation id * frame count + animation state.
+    Returns start index of the pixels of each sprite (S + 1, ), pixel rows, columns, pre blended colors and 1 - alpha"""
+    starts, rows, cols, colors, alphas = [0], [], [], [], []
+    for rotation in atlas:
+        for color, alpha in rotation:
+            row, col = np.nonzero(alpha[:, :, 0] < 1.)
+            starts.append(starts[-1] + len(row))
+            rows.append(row)
+            cols.append(col)
+            colors.append(color[row, col])
+            alphas.append(alpha[row, col, 0])
+    return np.array(starts), np.concatenate(rows), np.concatenate(cols), np.concatenate(colors), np.concatenate(alphas)
+
+
+# pre blended [color * alpha uint8, 1 - alpha float16] of all animations, loaded once per process
+sprites, sprite_depths, sprite_offsets = __load_sprite_atlas()
+sprite_frame_count = len(sprites[0])
+# visible pixels of all animations, see __flatten_sprites
+sprite_pixel_starts, sprite_pixel_rows, sprite_pixel_cols, sprite_pixel_colors, sprite_pixel_alphas = \
+    __flatten_sprites(sprites)
+
+
+def __load_flame_textures(count=8, size=128, seed=0) -> np.ndarray:
+    """Creates tileable noise textures for flame colors. Returns (count, size, size) float32 in [0, 1]"""
+    noise = np.random.default_rng(seed).random((count, size, size))
+    # blur with wrap around boundary, so textures tile seamlessly
+    kernel = np.array([[.05, .13, .05], [.13, .28, .13], [.05, .13, .05]])
+    kernel /= np.sum(kernel)
+    textures = np.zeros_like(noise)
+    for (i, j), weight in np.ndenumerate(kernel):
+        textures += weight * np.roll(noise, (i - 1, j - 1), axis=(1, 2))
+    return textures.astype(np.float32)
+
+
+# noise textures for flamer beams, created once per process
+flame_textures = __load_flame_textures()
+
+
 class FiringAnimator:
-    def __init__(self):
+    def __init__(self, seed: int | None = None):
+        """:param seed: Seed for random firing order and flame textures, None for different output every time"""
+        self.rng = np.random.default_rng(seed)
         self.firing_positions = np.zeros((0, 3), dtype=int)
         self.firing_directions = np.zeros((0, 3), dtype=int)
         self.firing_types = np.zeros(0, dtype=np.uint8)
-        # side animation
-        self.animation = [  cv2.imread("firing_animation/frame0.png", cv2.IMREAD_UNCHANGED),
-                            cv2.imread("firing_animation/frame1.png", cv2.IMREAD_UNCHANGED),
-                            cv2.imread("firing_animation/frame2.png", cv2.IMREAD_UNCHANGED),
-                            cv2.imread("firing_animation/frame3.png", cv2.IMREAD_UNCHANGED),
-                            cv2.imread("firing_animation/frame4.png", cv2.IMREAD_UNCHANGED),
-                            cv2.imread("firing_animation/frame5.png", cv2.IMREAD_UNCHANGED)]
-        self.animation_depth = [0, 1, 2, 2, 3, 3]
-        self.animation_origin = np.array([15, 0])
-        # front animation
-        self.animation_front = [cv2.imread("firing_animation/frame_front0.png", cv2.IMREAD_UNCHANGED),
-                                cv2.imread("firing_animation/frame_front1.png", cv2.IMREAD_UNCHANGED),
-                                cv2.imread("firing_animation/frame_front2.png", cv2.IMREAD_UNCHANGED),
-                                cv2.imread("firing_animation/frame_front3.png", cv2.IMREAD_UNCHANGED),
-                                cv2.imread("firing_animation/frame_front4.png", cv2.IMREAD_UNCHANGED),
-                                cv2.imread("firing_animation/frame_front5.png", cv2.IMREAD_UNCHANGED)]
-        self.animation_front_depth = [1, 4, 6, 6, 7, 7]
-        self.animation_front_origin = np.array([15, 15])
-        # back animation
-        self.animation_back = [ None,
-                                cv2.imread("firing_animation/frame_back1.png", cv2.IMREAD_UNCHANGED),
-                                cv2.imread("firing_animation/frame_back2.png", cv2.IMREAD_UNCHANGED)]
-        # anim offsets
-        a, b = self.animation_origin
-        c, d = self.animation[0].shape[0:2]
-        self.__animation_offset_list = np.array([[a, b],
-                                                [d - 5, c - a - 5],
-                                                [c - a - 5, d - 5],
-                                                [-b, c - a - 5],
-                                                self.animation_front_origin,
-                                                self.animation_front_origin])
-
-        self.max_frames = len(self.animation) * 5
+
+        self.max_frames = sprite_frame_count * 5
         self.state = None
 
         self.__current_frame = None
-        self.__current_index = None
         self.__total_frames = None
 
-        # pre blend animations
-        for i in range(len(self.animation)):
-            # side animation
-            alpha = self.animation[i][:, :, 3].astype(np.float16) / 255.
-            alpha = np.expand_dims(alpha, axis=2)
-            self.animation[i] = [(self.animation[i][:, :, :3] * alpha).astype(np.uint8), 1. - alpha]
-            # front animation
-            alpha = self.animation_front[i][:, :, 3].astype(np.float16) / 255.
-            alpha = np.expand_dims(alpha, axis=2)
-            self.animation_front[i] = [(self.animation_front[i][:, :, :3] * alpha).astype(np.uint8), 1. - alpha]
-        # back animation
-        for i in [1, 2]:
-            alpha = self.animation_back[i][:, :, 3].astype(np.float16) / 255.
-            alpha = np.expand_dims(alpha, axis=2)
-            self.animation_back[i] = [(self.animation_back[i][:, :, :3] * alpha).astype(np.uint8), 1. - alpha]
-        self.animation_back[0] = self.animation_front[0]
-        self.animation_back.extend(self.animation_front[3:])
+    def get_colors(self, background):
+        """Colors of all visible pixels of all animation images blended onto background color.
+        :param background: Color BGR
+        :return: Colors (N, 3) uint8
+        """
+        colors = []
+        for img in sprites[0] + sprites[4] + sprites[5][1:3]:
+            visible = img[1][:, :, 0] < 1.
+            colors.append((img[0][visible] + background * img[1][visible]).astype(np.uint8))
+        return np.concatenate(colors)
+
+    def get_flame_mix(self, shape):
+        """Random sub rectangle of the flame textures, tiled if larger than them.
+        :param shape: [rows, columns]
+        :return: Mix values float32 in [0, 1]
+        """
+        count, size = flame_textures.shape[:2]
+        texture = flame_textures[self.rng.integers(count)]
+        row, col = self.rng.integers(size, size=2)
+        return texture[np.ix_((row + np.arange(shape[0])) % size, (col + np.arange(shape[1])) % size)]
 
     def append(self, firing_positions, firing_directions, firing_type):
         self.firing_positions = np.concatenate((self.firing_positions, firing_positions), axis=0)
@@ -81,18 +135,18 @@ class FiringAnimator:
         0, 1, 2 normal y,z,x axis,
         3, 4, 5 inverted y,z,x axis
         """
-        max_spaced_frame_count = min(len(self.firing_positions) * len(self.animation), self.max_frames)
-        available_frames = max_spaced_frame_count - len(self.animation) + 1
+        max_spaced_frame_count = min(len(self.firing_positions) * sprite_frame_count, self.max_frames)
+        available_frames = max_spaced_frame_count - sprite_frame_count + 1
         shots_per_frame = len(self.firing_positions) / available_frames
         self.state = np.zeros(len(self.firing_positions), dtype=np.int8)
         if axis == -2:
             # fire all at the same time
-            self.__total_frames = len(self.animation)
+            self.__total_frames = sprite_frame_count
             return
         elif axis == -1:
             # random firing order
             order = np.arange(len(self.firing_positions))
-            np.random.shuffle(order)
+            self.rng.shuffle(order)
         else:
             order = np.argsort(self.firing_positions[:, axis % 3])
             if axis < 3:
@@ -113,7 +167,7 @@ class FiringAnimator:
                     do_loop = False
                     break
                 shots_available -= 1
-        self.__total_frames = abs(start_frame) + len(self.animation)
+        self.__total_frames = abs(start_frame) + sprite_frame_count
 
     def iter_frames(self):
         if self.state is None:
@@ -123,63 +177,26 @@ class FiringAnimator:
             self.state += 1
         self.__current_frame = None
 
-    def iter_ordered(self, axis):
+    def iter_sample_frames(self, count):
+        """Iterates up to count evenly spaced frames, e.g. to collect colors before the animation.
+        Animation state is restored afterwards."""
+        if self.state is None:
+            raise Exception("Call setup_ordered first.")
+        state = self.state
+        total = self.get_total_frame_count()
+        for self.__current_frame in np.unique(np.linspace(0, total - 1, min(count, total)).round().astype(int)):
+            self.state = state + self.__current_frame
+            yield self.__current_frame
+        self.state = state
+        self.__current_frame = None
+
+    def get_ordered(self, axis):
+        """Positions, directions, types and animation states of all shots, ordered by position along axis.
+        Shots with states outside of [0, sprite_frame_count) are not visible in the current frame."""
+        if self.state is None:
+            raise Exception("Call setup_ordered first.")
         order = np.argsort(self.firing_positions[:, axis])
-        for self.__current_index in order:
-            yield self.firing_positions[self.__current_index], self.firing_directions[self.__current_index], \
-                    self.firing_types[self.__current_index]
-        self.__current_index = None
-
-    def get_animation_type(self):
-        return self.firing_types[self.__current_index]
-
-    def get_animation_state(self):
-        state = self.state[self.__current_index]
-        if state < 0 or state >= len(self.animation):
-            return None
-        return state
-
-    def get_animation(self, rotation_id=0):
-        """Returns current animation image, animation depth and offset to its origin.
-        :param rotation_id: 0 = right, 1 = up, 2 = left, 3 = down, 4 = forwards, 5 = backwards
-        :return: image, depth and offset
-        """
-        state = self.state[self.__current_index]
-        if state < 0:
-            return None
-        #flipA = False
-        #flipB = False
-        if state >= len(self.animation):
-            return None
-            #state = len(self.animation) - 1
-            #flipA = np.random.randint(0, 2, dtype=np.bool)
-            #flipB = np.random.randint(0, 2, dtype=np.bool)
-
-            #state = np.random.randint(-2, 0) + len(self.animation)
-            #alpha_mul = pow(.999, state - len(self.animation) + 1)
-
-            #state = len(self.animation) - 1
-        img = self.animation[state]
-        depth = self.animation_depth[state]
-        if rotation_id == 1:
-            img = [np.flipud(np.transpose(img[0], (1, 0, 2))), np.flipud(np.transpose(img[1], (1, 0, 2)))]
-        elif rotation_id == 2:
-            img = [np.fliplr(img[0]), np.fliplr(img[1])]
-        elif rotation_id == 3:
-            img = [np.fliplr(np.transpose(img[0], (1, 0, 2))), np.fliplr(np.transpose(img[1], (1, 0, 2)))]
-        elif rotation_id == 4:
-            img = self.animation_front[state]
-            depth = self.animation_front_depth[state]
-        elif rotation_id == 5:
-            img = self.animation_back[state]
-            depth = 0  # self.animation_back_depth[state]
-        #if alpha_mul:
-        #    img[:, :, 3] = img[:, :, 3] * alpha_mul
-        #if flipA:
-        #    img = np.fliplr(img)
-        #if flipB:
-        #    img = np.flipud(img)
-        return img, depth, self.__animation_offset_list[rotation_id]
+        return self.firing_positions[order], self.firing_directions[order], self.firing_types[order], self.state[order]
 
     def clear(self):
         self.firing_positions = np.zeros((0, 3), dtype=int)
@@ -188,5 +205,4 @@ class FiringAnimator:
         self.state = None
 
         self.__current_frame = None
-        self.__current_index = None
         self.__total_frames = None
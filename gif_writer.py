@@ -0,0 +1,101 @@
+import io
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+
+class GifPalette:
+    """Global 256 color palette of an animation, computed once from its base image and the colors drawn onto it.
+    Other colors are mapped with a lookup table of LOOKUP_BITS bits per channel."""
+    LOOKUP_BITS = 6
+
+    def __init__(self, base_img: np.ndarray, extra_colors: np.ndarray, extra_weight: float = 0.5):
+        """
+        :param base_img: Base image BGR uint8, which every frame is drawn onto
+        :param extra_colors: (N, 3) BGR uint8 colors which are drawn onto the base image, e.g. all changed pixels
+            of some frames, so frequent colors get more palette entries
+        :param extra_weight: Maximum number of extra colors relative to the pixel count of the base image,
+            more extra colors are subsampled
+        """
+        base_pixels = base_img.reshape(-1, 3)
+        max_extra = int(len(base_pixels) * extra_weight)
+        if len(extra_colors) > max_extra:
+            extra_colors = extra_colors[np.linspace(0, len(extra_colors) - 1, max_extra).astype(int)]
+        # base and extra colors are quantized together, weighted by their pixel count
+        # maximum coverage keeps small details, kmeans improves the overall error,
+        # stopping when at most 1000 distinct colors change their palette entry is much faster than full convergence
+        pixels = np.concatenate((base_pixels, extra_colors))
+        quantized = Image.fromarray(np.ascontiguousarray(pixels[:, np.newaxis, ::-1])).quantize(
+            256, method=Image.Quantize.MAXCOVERAGE, kmeans=1000)
+        self.base_indices: np.ndarray = np.asarray(quantized, dtype=np.uint8)[:len(base_pixels), 0].reshape(
+            base_img.shape[:2])
+        """palette indices of base image"""
+        palette = np.array(quantized.getpalette(), dtype=np.uint8).reshape(-1, 3)[:, ::-1]
+        self.colors = np.zeros((256, 3), dtype=np.uint8)
+        """palette BGR"""
+        self.colors[:len(palette)] = palette
+        self.__create_lookup(palette)
+
+    def __create_lookup(self, palette: np.ndarray):
+        """Lookup table of nearest palette color for every cell center, index is b << 2 * bits | g << bits | r"""
+        bits = self.LOOKUP_BITS
+        centers = (np.arange(1 << bits, dtype=np.int32) << (8 - bits)) + (1 << (7 - bits))
+        cells = np.stack(np.meshgrid(centers, centers, indexing="ij"), axis=-1).reshape(-1, 1, 2)
+        palette = palette.astype(np.int32)
+        distance_gr = np.sum((cells - palette[:, 1:]) ** 2, axis=2)
+        self.lookup = np.zeros(1 << 3 * bits, dtype=np.uint8)
+        for b, center in enumerate(centers):
+            # one blue value at a time, to keep the distance matrix small
+            distance = distance_gr + (center - palette[:, 0]) ** 2
+            self.lookup[b << 2 * bits:(b + 1) << 2 * bits] = np.argmin(distance, axis=1)
+
+    def map(self, colors: np.ndarray) -> np.ndarray:
+        """Palette indices of BGR uint8 colors of shape (..., 3)"""
+        bits = self.LOOKUP_BITS
+        colors = colors >> (8 - bits)
+        return self.lookup[(colors[..., 0].astype(np.int32) << 2 * bits) | (colors[..., 1].astype(np.int32) << bits)
+                           | colors[..., 2]]
+
+
+class GifWriter:
+    """Streams an animated gif with a global palette. Frames are written as soon as they are added
+    and can be subrectangles, which are drawn over the previous frame."""
+    def __init__(self, file: str | io.IOBase, shape: tuple[int, int], palette: GifPalette, loop: int = 0):
+        """
+        :param file: File name or writable binary file object, which is not closed
+        :param shape: [rows, columns] of animation
+        :param palette: Global palette of all frames
+        :param loop: Number of loops, 0 for endless
+        """
+        self._own_file = isinstance(file, str)
+        self.fp = open(file, "wb") if self._own_file else file
+        # header, global color table of 256 colors, looping extension
+        self.fp.write(b"GIF89a" + int(shape[1]).to_bytes(2, "little") + int(shape[0]).to_bytes(2, "little")
+                      + b"\xf7\x00\x00" + palette.colors[:, ::-1].tobytes())
+        self.fp.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + loop.to_bytes(2, "little") + b"\x00")
+
+    def write(self, indices: np.ndarray, offset: tuple[int, int] = (0, 0), duration: int = 100):
+        """
+        Writes frame or part of frame.
+
+        :param indices: Palette indices uint8 of shape [rows, columns]
+        :param offset: [row, column] of indices in frame
+        :param duration: Display time in ms, stored in steps of 10 ms
+        """
+        indices = np.ascontiguousarray(indices)
+        img = Image.frombuffer("L", (indices.shape[1], indices.shape[0]), indices, "raw", "L", 0, 1)
+        # disposal 1 keeps the frame, so the next subrectangle is drawn over it
+        # getdata is not documented, the pillow version is pinned in requirements.txt
+        for data in GifImagePlugin.getdata(img, offset=(int(offset[1]), int(offset[0])), duration=duration, disposal=1):
+            self.fp.write(data)
+
+    def close(self):
+        """Writes trailer and closes file, if it was opened by the writer"""
+        self.fp.write(b";")
+        if self._own_file:
+            self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
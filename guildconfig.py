@@ -1,5 +1,6 @@
 import json
 import os
+import json_backend
 from discord import Guild, app_commands, Interaction
 from discord.abc import GuildChannel
 from discord.ext import commands
@@ -55,7 +56,7 @@ class GuildconfigManager():
             _log.info("Created guildconfig.json")
         with open(GUILDCONFIG_FILE, "r") as f:
             try:
-                config = json.load(f)
+                config = json_backend.load(f)
             except:
                 _log.error("<guildconfig> guildconfig.json unreadable.")
                 config = {}
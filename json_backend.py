@@ -0,0 +1,39 @@
+import json
+
+# optional faster backends, first available one is used
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+    _backend_loads = orjson.loads
+elif simdjson is not None:
+    BACKEND = "simdjson"
+    _backend_loads = simdjson.loads
+else:
+    BACKEND = "json"
+    _backend_loads = None
+
+
+def loads(data: bytes | str):
+    """Parse json from bytes or str.
+    Input rejected by the optional backend (e.g. UTF-8 BOM or NaN) is parsed again with json,
+    so the backend never narrows which files are accepted."""
+    if _backend_loads is not None:
+        try:
+            return _backend_loads(data)
+        except ValueError:
+            pass
+    return json.loads(data)
+
+
+def load(fp):
+    """Parse json from file object"""
+    return loads(fp.read())
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import multiprocessing
+import traceback
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bp_to_img
+
+_log = logging.getLogger("bot")
+
+
+class RenderQueueFull(Exception):
+    """Raised when no more render jobs can be queued."""
+
+
+class RenderTimeout(Exception):
+    """Raised when a render job exceeded the timeout and was stopped."""
+
+
+class RenderError(Exception):
+    """Raised when process_blueprint failed in a worker process.
+    Only keeps name, message and formatted traceback of the original exception, as not all exceptions
+    keep their attributes when pickled (e.g. json.JSONDecodeError), and the render context of the job."""
+
+    def __init__(self, type_name: str, message: str, traceback: str, context: bp_to_img.RenderContext):
+        super().__init__(type_name, message, traceback, context)
+        self.type_name = type_name
+        self.message = message
+        self.traceback = traceback
+        self.context = context
+
+    def __str__(self):
+        return f"{self.type_name}: {self.message}"
+
+
+def _render_job(file, kwargs: dict, measure_memory: bool):
+    """Runs in a worker process. Returns result of process_blueprint and the render context."""
+    context = bp_to_img.RenderContext()
+    if measure_memory:
+        tracemalloc.start()
+    try:
+        return bp_to_img.process_blueprint(file, context=context, **kwargs), context
+    except Exception as err:
+        # context (game version) and traceback are needed for the error report in the bot process
+        context.firing_animator = None
+        raise RenderError(type(err).__name__, str(err), traceback.format_exc(), context) from None
+    finally:
+        tracemalloc.stop()
+
+
+def _terminate(worker: ProcessPoolExecutor):
+    """Kills processes of worker and shuts it down without waiting for its job"""
+    if hasattr(worker, "terminate_workers"):
+        worker.terminate_workers()  # python 3.14
+        return
+    for process in list((worker._processes or {}).values()):
+        process.terminate()
+    worker.shutdown(wait=False, cancel_futures=True)
+
+
+class RenderPool:
+    """Runs bp_to_img.process_blueprint in worker processes, so the event loop is never blocked.
+
+    Every worker is an executor with a single process, so a job which timed out or got cancelled
+    can be terminated without affecting jobs of other workers. Worker processes are started by a forkserver
+    with this module and bp_to_img preloaded (spawned where there is no forkserver), never by forking the bot process.
+    Like spawned processes, every worker imports the main module again as __mp_main__, so it must not
+    have side effects outside of its `if __name__ == "__main__"` block.
+    A worker process which died is detected and replaced. Call close when done."""
+
+    def __init__(self, processes: int = 2, queue_size: int = 8, timeout: float | None = 180.):
+        """
+        :param processes: Number of worker processes
+        :param queue_size: Maximum number of running and waiting jobs
+        :param timeout: Seconds after which a running job is stopped, None for no timeout
+        """
+        self.processes = max(1, processes)
+        self.queue_size = max(self.processes, queue_size)
+        self.timeout = timeout
+        # workers are forked from the forkserver, which shares the loaded block data,
+        # spawned workers (no forkserver on windows) load it themselves
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self._mp_context = multiprocessing.get_context("forkserver")
+            self._mp_context.set_forkserver_preload([__name__])
+        else:
+            self._mp_context = multiprocessing.get_context("spawn")
+        self._idle: asyncio.Queue[ProcessPoolExecutor] = asyncio.Queue()
+        for _ in range(self.processes):
+            self._idle.put_nowait(self._create_worker())
+        self._jobs = 0
+
+    def _create_worker(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=1, mp_context=self._mp_context)
+
+    def _replace_worker(self, worker: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        """Terminates worker in the background and returns a new one"""
+        asyncio.get_running_loop().run_in_executor(None, _terminate, worker)
+        return self._create_worker()
+
+    @property
+    def pending(self) -> int:
+        """Number of running and waiting jobs"""
+        return self._jobs
+
+    async def render(self, file: list[str | bytes], measure_memory=False, **kwargs):
+        """Renders blueprint in a worker process. Arguments are the same as for bp_to_img.process_blueprint.
+        Returns result of process_blueprint and the bp_to_img.RenderContext of the job.
+        measure_memory traces allocations of the job to store its peak memory in the render context,
+        which slows down rendering.
+
+        Raises RenderQueueFull, RenderTimeout, BrokenProcessPool if the worker process died,
+        or RenderError if process_blueprint raised an exception.
+        Cancelling the awaiting task terminates the job."""
+        if self._jobs >= self.queue_size:
+            raise RenderQueueFull(f"Render queue is full ({self._jobs} jobs)")
+        self._jobs += 1
+        try:
+            worker = await self._idle.get()
+            try:
+                job = asyncio.get_running_loop().run_in_executor(worker, _render_job, file, kwargs, measure_memory)
+                return await asyncio.wait_for(job, self.timeout)
+            except BrokenProcessPool:
+                _log.error("Render worker process died")
+                worker = self._replace_worker(worker)
+                raise
+            except TimeoutError:
+                _log.warning("Render job exceeded timeout of %s s", self.timeout)
+                worker = self._replace_worker(worker)
+                raise RenderTimeout(f"Render job exceeded timeout of {self.timeout} s") from None
+            except asyncio.CancelledError:
+                _log.info("Render job cancelled")
+                worker = self._replace_worker(worker)
+                raise
+            finally:
+                self._idle.put_nowait(worker)
+        finally:
+            self._jobs -= 1
+
+    def close(self):
+        """Terminates all idle workers"""
+        while not self._idle.empty():
+            _terminate(self._idle.get_nowait())
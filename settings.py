@@ -19,6 +19,16 @@ else:  # load encrypted credential provided with systemd-creds
             return f.read()
     TOKEN = __token
 
+# blueprint rendering worker processes, job queue size and per job timeout in seconds
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", 2))
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", 8))
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", 180))
+# png zlib compression level 0-9 (opencv default if not set), 256 color palette and upload size limit in bytes,
+# larger images are sent as lossless webp or downscaled
+PNG_COMPRESSION = int(os.getenv("PNG_COMPRESSION")) if os.getenv("PNG_COMPRESSION") else None
+PNG_QUANTIZE = bool(os.getenv("PNG_QUANTIZE"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", 10 * 1024 * 1024))
+
 # create bp_folder
 if not os.path.exists(BP_FOLDER):
     os.mkdir(BP_FOLDER)
@@ -0,0 +1,22 @@
+# run from repository root: python -m pytest test_bp_to_img.py
+import numpy as np
+import pytest
+from bp_to_img import parse_vectors
+
+
+def test_parse_vectors_int():
+    res = parse_vectors(["1,2,3", "-4,5,-6"], 3)
+    assert res.dtype == np.int32
+    assert res.tolist() == [[1, 2, 3], [-4, 5, -6]]
+
+
+def test_parse_vectors_fractional_position():
+    # local positions and block positions can have fractional components, which are rounded
+    res = parse_vectors(["1,2,3.5", "0.4,-2.6,4"], 3, int)
+    assert res.tolist() == [[1, 2, 4], [0, -3, 4]]
+    assert parse_vectors(["1.25,2,3.5"], 3, float).tolist() == [[1.25, 2., 3.5]]
+
+
+def test_parse_vectors_wrong_column_count():
+    with pytest.raises(ValueError):
+        parse_vectors(["1,2,3", "4,5"], 3)
@@ -0,0 +1,15 @@
+# run from repository root: python -m pytest test_json_backend.py
+import math
+import pytest
+import json_backend
+
+
+def test_loads_accepts_what_json_accepts():
+    # optional backends reject a UTF-8 BOM and NaN, which json accepts
+    assert json_backend.loads(b'\xef\xbb\xbf{"a": 1}') == {"a": 1}
+    assert math.isnan(json_backend.loads(b'{"a": NaN}')["a"])
+
+
+def test_loads_invalid():
+    with pytest.raises(ValueError):
+        json_backend.loads(b'{"a": ')